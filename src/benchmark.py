@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import chess, argparse, registry, os, heapq
+import numpy as np
+from pathlib import Path
+from time import perf_counter
+from evaluator import Evaluator
+from search import Searcher
+
+# measures the speedup of the parallel root search (see Searcher.search_root_parallel) against the number of workers
+# (the moves of all worker counts have to be the same)
+# with fewer cores than workers, the time on enough cores is projected from the cpu times of the tasks (see projected_time)
+# with --prefilter: compares hybrid evaluation (see Evaluator.select_children) with K = ... against evaluating all children
+# (model evaluations, time and how many of the chosen moves change)
+# with --prune: compares the selective search features (see Searcher) against the full width search
+# (nodes, time, completed depth with --movetime and how many of the chosen moves change)
+
+path = Path(__file__).absolute().parent.parent
+
+
+def test_positions(n, seed=0, min_plies=8, max_plies=40):
+    # n positions reached by random moves from the starting position
+
+    rng = np.random.RandomState(seed)
+    positions = []
+
+    while len(positions) < n:
+        board = chess.Board()
+
+        for _ in range(rng.randint(min_plies, max_plies + 1)):
+            moves = tuple(board.legal_moves)
+            if not moves: break
+            board.push(moves[rng.randint(0, len(moves))])
+
+        if not board.is_game_over(): positions.append(board)
+
+    return positions
+
+
+def projected_time(elapsed, task_times, workers):
+    # time of a parallel search with 1 core per worker: the tasks of every batch are handed to the next free worker
+    # in order (like Pool.map_async with chunksize 1), the rest of the elapsed time (this process) stays the same
+    # task_times: cpu times of the tasks, 1 list per batch (see Searcher.run_tasks)
+
+    projected = elapsed
+
+    for times in task_times:
+        finished = [0.0] * workers # time each worker is done with its tasks
+
+        for task_time in times: heapq.heappush(finished, heapq.heappop(finished) + task_time)
+
+        projected += max(finished) - sum(times)
+
+    return projected
+
+
+def run(positions, model_path, backend, depth, workers, prefilter=None, **options):
+    # search all positions with a number of workers, returns the moves, the total time, the number of searched nodes,
+    # the Evaluator (its stats), the average completed depth and the cpu times of the pool tasks (see projected_time)
+    # (options: further arguments of the Searchers)
+
+    model = Evaluator(registry.get(model_path, backend), prefilter=prefilter)
+    pool = registry.get_pool(model_path, backend, workers) if workers > 1 else None
+
+    if pool: pool[0].map(Searcher.search_move, [(positions[0], 1, chess.WHITE, -np.inf, None, None, False, True, None, (), None, None, None, False)] * workers) # load the models of the workers
+
+    moves, nodes, depths, task_times = [], 0, 0, []
+    start = perf_counter()
+
+    for board in positions:
+        searcher = Searcher(model, depth, pool=pool, **options)
+        moves.append(searcher.predict_best_move(board, board.turn))
+        nodes += searcher.nodes
+        depths += searcher.completed_depth
+        task_times += searcher.task_times
+
+    return moves, perf_counter() - start, nodes, model, depths / len(positions), task_times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", "-d", metavar="N", type=int, default=2, help="search depth")
+    parser.add_argument("--positions", "-n", metavar="N", type=int, default=10, help="number of test positions")
+    parser.add_argument("--workers", "-w", metavar="N", type=int, nargs="+", default=[1, 2, 4, 8], help="numbers of workers to compare")
+    parser.add_argument("--engine", "-e", choices=("keras", "numpy", "int8", "float16"), default="numpy", help="inference backend")
+    parser.add_argument("--seed", metavar="N", type=int, default=0, help="seed of the test positions")
+    parser.add_argument("--prefilter", metavar="K", type=int, nargs="+", help="compare hybrid evaluation with these K (with the first number of workers)")
+    parser.add_argument("--prune", nargs="+", choices=("null", "lmr", "futility"), help="compare these selective search features (each one and all of them)")
+    parser.add_argument("--movetime", "-t", metavar="MS", type=float, help="time per move for --prune (iterative deepening up to --depth)")
+
+    args = parser.parse_args()
+
+    model_path = path.joinpath("model/chess_model_v2").as_posix()
+    positions = test_positions(args.positions, args.seed)
+    baseline = None
+
+    if args.prefilter:
+        # model evaluations of the workers aren't counted, compare with 1 worker
+        for prefilter in [None] + args.prefilter:
+            moves, elapsed, nodes, model, _, _ = run(positions, model_path, args.engine, args.depth, args.workers[0], prefilter)
+
+            if baseline is None: baseline, baseline_moves, baseline_predicted = elapsed, moves, model.predicted
+
+            changed = sum(move != baseline_move for move, baseline_move in zip(moves, baseline_moves))
+            print(f"prefilter {prefilter or 'off'}: {elapsed:.2f} s ({baseline / elapsed:.2f}x), {model.predicted} model evaluations "
+                  f"({100 * (1 - model.predicted / max(baseline_predicted, 1)):.1f}% saved), {changed}/{len(moves)} moves changed")
+
+    elif args.prune:
+        movetime = args.movetime / 1000 if args.movetime else None
+        configs = [()] + [(feature,) for feature in args.prune] + ([tuple(args.prune)] if len(args.prune) > 1 else [])
+
+        for pruning in configs:
+            moves, elapsed, nodes, _, depth, _ = run(positions, model_path, args.engine, args.depth, args.workers[0], pruning=pruning, movetime=movetime)
+
+            if baseline is None: baseline, baseline_moves, baseline_nodes = elapsed, moves, nodes
+
+            changed = sum(move != baseline_move for move, baseline_move in zip(moves, baseline_moves))
+            print(f"pruning {'+'.join(pruning) or 'off'}: {elapsed:.2f} s ({baseline / elapsed:.2f}x), {nodes} nodes ({nodes / max(baseline_nodes, 1):.2f}x), "
+                  f"depth {depth:.2f}, {changed}/{len(moves)} moves changed")
+
+    else:
+        for workers in args.workers:
+            moves, elapsed, nodes, _, _, task_times = run(positions, model_path, args.engine, args.depth, workers)
+
+            if baseline is None: baseline, baseline_moves, baseline_nodes = elapsed, moves, nodes
+
+            same = "same moves" if moves == baseline_moves else "DIFFERENT MOVES"
+            print(f"{workers} workers: {elapsed:.2f} s ({baseline / elapsed:.2f}x), {nodes} nodes ({nodes / max(baseline_nodes, 1):.2f}x), "
+                  f"{nodes / elapsed:.0f} nodes/s, {same}")
+
+            if workers > (os.cpu_count() or 1):
+                projected = projected_time(elapsed, task_times, workers)
+                print(f"    only {os.cpu_count()} cores, projected on {workers} cores: {projected:.2f} s ({baseline / projected:.2f}x)")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import chess, chess.polyglot, argparse, zobrist
+import numpy as np
+from pathlib import Path
+from time import perf_counter
+from pgnparser import PGNParser
+
+# opening book built from the games in data/*.pgn in the polyglot format
+# (16 byte entries sorted by zobrist hash: hash of the position, move, weight, learn (unused), all big endian),
+# read with chess.polyglot.open_reader (memory-mapped, binary search for the hash of a position)
+
+path = Path(__file__).absolute().parent.parent
+BOOK_FILE = path.joinpath("data/book.bin")
+
+ENTRY = np.dtype([("key", ">u8"), ("move", ">u2"), ("weight", ">u2"), ("learn", ">u4")])
+
+
+def encode_move(board, move):
+    # polyglot encoding of a move: to square | from square << 6 | promotion piece << 12 (knight 1 ... queen 4),
+    # castling is encoded as the king capturing its own rook
+
+    to_sq = move.to_square
+
+    if board.is_castling(move): to_sq = chess.square(7 if board.is_kingside_castling(move) else 0, chess.square_rank(move.from_square))
+
+    return to_sq | move.from_square << 6 | (move.promotion - 1 if move.promotion else 0) << 12
+
+
+def build(pgn_dir=path.joinpath("data"), book_file=BOOK_FILE, max_ply=24, min_weight=2):
+    # write the book of the first max_ply plies of all decisive games of the pgn files in pgn_dir
+    # weight of a move: 2 for every game won by the player who played it, 1 for every lost game
+    # (moves with less than min_weight are dropped, the weights are scaled down to 16 bit if necessary)
+    # returns the number of entries
+
+    weights = {} # (zobrist hash, polyglot move) -> weight
+
+    for pgn_file in sorted(Path(pgn_dir).glob("*.pgn")):
+        with open(pgn_file) as pgn:
+            for _, board, winner, moves_played in PGNParser.read_games(pgn):
+                board = board.copy(stack=False)
+                key = zobrist.board_key(board)
+
+                for move in moves_played[:max_ply]:
+                    entry = (key, encode_move(board, move))
+                    weights[entry] = weights.get(entry, 0) + (2 if board.turn == winner else 1)
+
+                    key ^= zobrist.move_key(board, move) ^ zobrist.state_key(board)
+                    board.push(move)
+                    key ^= zobrist.state_key(board)
+
+    weights = {entry: weight for entry, weight in weights.items() if weight >= min_weight}
+    scale = max(weights.values(), default=0) // 0x10000 + 1
+
+    entries = np.zeros(len(weights), dtype=ENTRY)
+    entries["key"] = np.fromiter((key for key, _ in weights), dtype=np.uint64, count=len(weights))
+    entries["move"] = np.fromiter((move for _, move in weights), dtype=np.uint16, count=len(weights))
+    entries["weight"] = np.maximum(np.fromiter(weights.values(), dtype=np.int64, count=len(weights)) // scale, 1)
+
+    # sorted by hash (the reader's binary search), moves of a position by descending weight
+    entries = entries[np.lexsort((-entries["weight"].astype(np.int64), entries["key"]))]
+    entries.tofile(book_file)
+
+    return entries.size
+
+
+def open_book(book_file=BOOK_FILE):
+    # memory-mapped reader of the book (built first if it doesn't exist)
+
+    if not Path(book_file).is_file(): build(book_file=book_file)
+
+    return chess.polyglot.open_reader(book_file)
+
+
+def book_move(reader, board, rng=None):
+    # move of the book for a board (random, weighted by the weights of the moves), None if the position isn't in it
+
+    try:
+        return reader.weighted_choice(board, random=rng).move
+    except IndexError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plies", metavar="N", type=int, default=24, help="number of plies of every game that go into the book")
+    parser.add_argument("--min-weight", metavar="N", type=int, default=2, help="min weight of a move (2 per won game, 1 per lost game)")
+
+    args = parser.parse_args()
+
+    start = perf_counter()
+    n = build(max_ply=args.plies, min_weight=args.min_weight)
+
+    print(f"{BOOK_FILE}: {n} entries ({BOOK_FILE.stat().st_size / 1024:.0f} KiB) built in {perf_counter() - start:.1f} s")
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import json
+import numpy as np
+import encoder
+from pathlib import Path
+
+
+class ShardWriter:
+    # writes training data into fixed-size uncompressed .npy shards
+    # plus a small manifest (manifest.json) describing them
+
+    def __init__(self, path, shard_size=100000, packed=False):
+        self.path = Path(path)
+        self.shard_size = shard_size # number of samples per shard (the last shard may be smaller)
+        self.packed = packed # samples are bit-packed bitboards (see encoder.pack_boards) instead of 8x8x6 tensors
+        self.shards = [] # manifest entries of all written shards
+        self.size = 0 # total number of samples written
+
+        self.X_pending, self.y_pending = [], [] # samples that don't fill a whole shard yet
+        self.pending = 0
+
+        # shape/dtype of the samples and dtype of the labels (like PGNParser.empty_samples, set by write(),
+        # so the manifest is valid even if no samples are written)
+        self.sample_shape, self.dtype = ((12,), np.dtype("<u8")) if packed else ((8, 8, 6), np.dtype(np.int8))
+        self.y_dtype = np.dtype(np.uint8)
+
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def write(self, X, y):
+        # add samples to the dataset (full shards are written to disk right away)
+
+        self.X_pending.append(X)
+        self.y_pending.append(y)
+        self.pending += len(y)
+
+        self.sample_shape, self.dtype, self.y_dtype = X.shape[1:], X.dtype, y.dtype
+
+        while self.pending >= self.shard_size: self.flush(self.shard_size)
+
+    def flush(self, n):
+        # write the first n pending samples into a new shard
+
+        X, y = np.concatenate(self.X_pending), np.concatenate(self.y_pending)
+        shard = len(self.shards)
+
+        entry = {"X": f"X_{shard:05d}.npy", "y": f"y_{shard:05d}.npy", "size": n}
+        np.save(self.path.joinpath(entry["X"]), X[:n])
+        np.save(self.path.joinpath(entry["y"]), y[:n])
+
+        self.shards.append(entry)
+        self.size += n
+
+        self.X_pending, self.y_pending = [X[n:]], [y[n:]]
+        self.pending -= n
+
+    def close(self):
+        # write the remaining samples and the manifest
+
+        if self.pending: self.flush(self.pending)
+
+        manifest = {"size": self.size, "shard_size": self.shard_size, "sample_shape": list(self.sample_shape),
+                    "dtype": self.dtype.str, "y_dtype": self.y_dtype.str, "packed": self.packed, "shards": self.shards}
+
+        with open(self.path.joinpath("manifest.json"), "w") as fout: json.dump(manifest, fout, indent=2)
+
+
+class ShardedDataset:
+    # a dataset written by ShardWriter
+    # (the shards are opened as memory maps, so only the samples that get accessed are read from disk;
+    # bit-packed samples are unpacked to 8x8x6 tensors batch by batch in take())
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+        with open(self.path.joinpath("manifest.json")) as fin: manifest = json.load(fin)
+
+        self.size = manifest["size"]
+        self.shard_size = manifest["shard_size"]
+        self.stored_shape = tuple(manifest["sample_shape"])
+        self.dtype = np.dtype(manifest["dtype"])
+        self.y_dtype = np.dtype(manifest.get("y_dtype", "|u1"))
+        self.packed = manifest.get("packed", False)
+        self.sample_shape = (8, 8, 6) if self.packed else self.stored_shape # shape of the samples returned by take()
+
+        self.X_shards = [np.load(self.path.joinpath(shard["X"]), mmap_mode="r") for shard in manifest["shards"]]
+        self.y_shards = [np.load(self.path.joinpath(shard["y"]), mmap_mode="r") for shard in manifest["shards"]]
+
+    @staticmethod
+    def exists(path):
+        return Path(path).joinpath("manifest.json").is_file()
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def shape(self):
+        return (self.size,) + self.sample_shape
+
+    def read(self, indices):
+        # read the samples at the given (global) indices from the shards as they are stored (bit-packed or not)
+
+        indices = np.asarray(indices)
+        shards = indices // self.shard_size
+
+        X = np.empty((indices.size,) + self.stored_shape, dtype=self.dtype)
+        y = np.empty(indices.size, dtype=self.y_dtype)
+
+        for shard in np.unique(shards):
+            mask = shards == shard
+            local_indices = indices[mask] - shard * self.shard_size
+
+            X[mask] = self.X_shards[shard][local_indices]
+            y[mask] = self.y_shards[shard][local_indices]
+
+        return X, y
+
+    def take(self, indices):
+        # read the samples at the given (global) indices from the shards as 8x8x6 tensors
+
+        X, y = self.read(indices)
+
+        if self.packed: X = encoder.unpack_boards(X)
+
+        return X, y
+
+    def split(self, test_size=0.2, seed=None):
+        # randomly split the dataset into a train and a test view (index arrays, no copies of the data)
+
+        return DatasetView(self, np.arange(self.size)).split(test_size, seed)
+
+
+class DatasetView:
+    # a subset of a ShardedDataset given by an array of sample indices
+
+    def __init__(self, dataset, indices):
+        self.dataset = dataset
+        self.indices = indices
+
+    def __len__(self):
+        return self.indices.size
+
+    @property
+    def shape(self):
+        return (self.indices.size,) + self.dataset.sample_shape
+
+    def take(self, positions):
+        # read the samples at the given positions (relative to this view)
+
+        return self.dataset.take(self.indices[positions])
+
+    def blocks(self, block_size=1024):
+        # split the indices of the view into blocks of at most block_size indices,
+        # every block only contains indices of a single shard (-> can be read with one sequential pass)
+
+        shards = self.indices // self.dataset.shard_size
+        shard_starts = np.flatnonzero(np.diff(shards, prepend=-1)) # indices are sorted -> every shard is one run
+
+        return [block for shard_indices in np.split(self.indices, shard_starts[1:])
+                      for block in np.split(shard_indices, np.arange(block_size, shard_indices.size, block_size)) if block.size]
+
+    def split(self, test_size=0.2, seed=None):
+        # randomly split the view into two smaller views (e.g. for a validation set)
+
+        permutation = np.random.default_rng(seed).permutation(self.indices.size)
+        n_test = int(test_size * self.indices.size)
+
+        return DatasetView(self.dataset, np.sort(self.indices[permutation[n_test:]])), DatasetView(self.dataset, np.sort(self.indices[permutation[:n_test]]))
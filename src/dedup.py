@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import chess
+import chess.polyglot
+import numpy as np
+
+# random 64-bit constants mixed into the keys of the samples
+# (index: color of the tensor perspective, label)
+KEY_SALTS = ((0x9E3779B97F4A7C15, 0xBF58476D1CE4E5B9), (0x94D049BB133111EB, 0xD6E8FEB86659FD93))
+
+
+def sample_key(board, color, label):
+    # key of a training sample: zobrist hash of the board state plus the perspective and label of the sample
+
+    return chess.polyglot.zobrist_hash(board) ^ KEY_SALTS[color][label]
+
+
+class PositionSet:
+    # compact hash set of 64-bit sample keys (open addressing with linear probing in a numpy array,
+    # 8 bytes per slot), scales to tens of millions of positions
+
+    def __init__(self, capacity=1 << 16, max_load=0.7):
+        self.slots = np.zeros(capacity, dtype=np.uint64) # 0 marks an empty slot
+        self.max_load = max_load # the table doubles in size when it's fuller than this
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, keys):
+        # add an array of keys to the set
+        # returns a mask of the keys that were new (False for keys that were already
+        # in the set or occurred earlier in the same array)
+
+        keys = np.asarray(keys, dtype=np.uint64).copy()
+        keys[keys == 0] = 1 # 0 is reserved for empty slots
+
+        # only the first occurrence of a key in the array can be new
+        new = np.zeros(keys.size, dtype=bool)
+        first = np.unique(keys, return_index=True)[1]
+
+        while (self.size + first.size) > self.max_load * self.slots.size: self.resize(2 * self.slots.size)
+
+        new[first] = self.insert(keys[first])
+        self.size += int(np.count_nonzero(new))
+
+        return new
+
+    def insert(self, keys):
+        # insert unique keys into the table (vectorized linear probing)
+        # returns a mask of the keys that weren't in the table yet
+
+        mask = np.uint64(self.slots.size - 1)
+        new = np.zeros(keys.size, dtype=bool)
+        pending = np.arange(keys.size) # keys that haven't found their slot yet
+        pos = keys & mask
+
+        while pending.size:
+            slots = self.slots[pos]
+
+            found = slots == keys[pending] # key is already in the table
+            empty = slots == 0
+
+            # several keys might want the same empty slot -> only the first one gets it in this round
+            empty_i = np.flatnonzero(empty)
+            claimed = empty_i[np.unique(pos[empty_i], return_index=True)[1]]
+
+            self.slots[pos[claimed]] = keys[pending[claimed]]
+            new[pending[claimed]] = True
+
+            done = found.copy()
+            done[claimed] = True
+
+            # all other keys probe the next slot (or the same one again if they lost it to another key)
+            probe_next = ~done & ~empty
+            pos = np.where(probe_next, (pos + np.uint64(1)) & mask, pos)[~done]
+            pending = pending[~done]
+
+        return new
+
+    def resize(self, capacity):
+        # move all keys into a bigger table
+
+        keys = self.slots[self.slots != 0]
+        self.slots = np.zeros(capacity, dtype=np.uint64)
+        self.insert(keys)
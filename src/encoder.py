@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import chess
+import numpy as np
+
+# order of the 6 layers of a 8x8x6 board tensor
+# (same order PGNParser has always used: k, p, r, b, n, q)
+LAYER_PIECE_TYPES = (chess.KING, chess.PAWN, chess.ROOK, chess.BISHOP, chess.KNIGHT, chess.QUEEN)
+
+
+def board_bitboards(board, color):
+    # get the 12 bitboards of a board (6 for the pieces of "color", 6 for the pieces of the opponent)
+    # pieces of "color" end up as 1, pieces of the opponent as -1 in the tensor
+
+    us, them = board.occupied_co[color], board.occupied_co[not color]
+    pieces = (board.kings, board.pawns, board.rooks, board.bishops, board.knights, board.queens)
+
+    return [bb & us for bb in pieces] + [bb & them for bb in pieces]
+
+
+def pack_boards(boards, color):
+    # convert a batch of boards to (N, 12) bit-packed samples (12 64-bit bitboards per board, 96 bytes instead of 384)
+    # bit r*8+c of a bitboard is row r, column c of the 8x8x6 tensor (see unpack_boards)
+
+    packed = np.array([board_bitboards(board, color) for board in boards], dtype="<u8").reshape(-1, 12)
+
+    if color == chess.WHITE:
+        # row 0 of the tensor is the 8th rank
+        # -> flip the board vertically (reverses the byte order of every bitboard)
+        packed.byteswap(inplace=True)
+
+    return packed
+
+
+def pack_board(board, color):
+    # convert a single board to 12 bit-packed bitboards
+
+    return pack_boards((board,), color)[0]
+
+
+def unpack_boards(packed, out=None):
+    # unpack (N, 12) bit-packed samples into (N, 8, 8, 6) tensors
+    # (written into out (preallocated (N, 8, 8, 6) array) if provided)
+
+    n = packed.shape[0]
+
+    if out is None: out = np.empty((n, 8, 8, 6), dtype=np.int8)
+
+    packed = np.ascontiguousarray(packed, dtype="<u8")
+    bits = np.unpackbits(packed.view(np.uint8), bitorder="little").view(np.int8).reshape(n, 2, 6, 8, 8)
+
+    # own pieces get 1, opponent's pieces get -1
+    out[:n] = (bits[:, 0] - bits[:, 1]).transpose(0, 2, 3, 1)
+
+    return out
+
+
+def encode_boards(boards, color, out=None):
+    # convert a batch of boards to 8x8x6 tensors (1 8x8 board for every figure)
+    # the tensors are written into out (preallocated (N, 8, 8, 6) array) if provided
+
+    return unpack_boards(pack_boards(boards, color), out)
+
+
+def encode_board(board, color):
+    # convert a single board to a 8x8x6 tensor
+
+    return encode_boards((board,), color)[0]
+
+
+# layer index of every piece type (indexed by chess.PAWN, ..., chess.KING)
+PIECE_TYPE_LAYERS = np.zeros(7, dtype=np.int64)
+PIECE_TYPE_LAYERS[list(LAYER_PIECE_TYPES)] = np.arange(6)
+
+# tensor row of every square (row 0 is the 8th rank for white, the 1st rank for black)
+SQUARE_ROWS = {chess.WHITE: [7 - chess.square_rank(sq) for sq in chess.SQUARES],
+               chess.BLACK: [chess.square_rank(sq) for sq in chess.SQUARES]}
+SQUARE_COLS = [chess.square_file(sq) for sq in chess.SQUARES]
+
+
+def apply_move(tensor, board, move, color):
+    # update the tensor of a board in place so it matches the board after the move
+    # (only touches the squares of the moved, captured, promoted or castled pieces)
+
+    rows = SQUARE_ROWS[color]
+    from_sq, to_sq = move.from_square, move.to_square
+    piece_type = board.piece_type_at(from_sq)
+    val = 1 if board.turn == color else -1
+
+    tensor[rows[from_sq], SQUARE_COLS[from_sq], PIECE_TYPE_LAYERS[piece_type]] = 0
+
+    if piece_type == chess.KING and board.is_castling(move):
+        # move the rook as well (also handles chess960 castling, where the king "captures" its rook)
+        rank = chess.square_rank(from_sq)
+        kingside = board.is_kingside_castling(move)
+        rook_from = to_sq if board.rooks & board.occupied_co[board.turn] & chess.BB_SQUARES[to_sq] else chess.square(7 if kingside else 0, rank)
+        rook_to = chess.square(5 if kingside else 3, rank)
+        to_sq = chess.square(6 if kingside else 2, rank)
+
+        rook_layer = PIECE_TYPE_LAYERS[chess.ROOK]
+        tensor[rows[rook_from], SQUARE_COLS[rook_from], rook_layer] = 0
+        tensor[rows[rook_to], SQUARE_COLS[rook_to], rook_layer] = val
+
+    elif piece_type == chess.PAWN and board.is_en_passant(move):
+        # the captured pawn is not on the target square
+        ep_sq = chess.square(chess.square_file(to_sq), chess.square_rank(from_sq))
+        tensor[rows[ep_sq], SQUARE_COLS[ep_sq], PIECE_TYPE_LAYERS[chess.PAWN]] = 0
+
+    else:
+        # remove a potentially captured piece
+        tensor[rows[to_sq], SQUARE_COLS[to_sq]] = 0
+
+    if move.promotion: piece_type = move.promotion
+
+    tensor[rows[to_sq], SQUARE_COLS[to_sq], PIECE_TYPE_LAYERS[piece_type]] = val
+
+    return tensor
+
+
+class ChildEncoder:
+    # encodes all child positions of a board (one per move) into one reusable batch buffer
+    # (the parent is encoded once, every child is derived from it by only updating the changed squares)
+
+    def __init__(self, capacity=256, dtype=np.float32):
+        self.buffer = np.empty((capacity, 8, 8, 6), dtype=dtype)
+
+    def encode_children(self, board, moves, color, offset=0):
+        # returns a view of the buffer containing the tensors of all child positions
+        # (only valid until the next call)
+        # offset: first buffer row to write to (the rows before it are kept, so the children
+        # of several boards can be collected into one batch)
+
+        n = len(moves)
+
+        if offset + n > self.buffer.shape[0]:
+            buffer = np.empty((max(offset + n, 2 * self.buffer.shape[0]),) + self.buffer.shape[1:], dtype=self.buffer.dtype)
+            buffer[:offset] = self.buffer[:offset]
+            self.buffer = buffer
+
+        children = self.buffer[offset:offset + n]
+        children[:] = encode_board(board, color)
+
+        for child, move in zip(children, moves): apply_move(child, board, move, color)
+
+        return children
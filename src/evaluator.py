@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import encoder
+import zobrist
+import pst
+
+# random 64-bit constants mixed into the cache keys (index: color of the perspective the board is evaluated from)
+PERSPECTIVE_SALTS = np.array([0x8D3E5A1C7B2F4960, 0x1F7A3C5E9B2D4086], dtype=np.uint64)
+
+
+class EvalCache:
+    # fixed-size table of model outputs keyed by zobrist hash + perspective
+    # (arrays of 2-entry buckets: a new entry goes into the first slot of its bucket,
+    # if the bucket is full its older entry is replaced)
+
+    def __init__(self, size=1 << 20):
+        self.size = size # number of entries (power of 2)
+        self.mask = np.uint64(size - 2) # bucket index mask (every bucket has 2 slots)
+        self.keys = np.zeros(size, dtype=np.uint64) # 0 marks an empty slot
+        self.values = np.zeros(size, dtype=np.float32)
+
+        self.hits = self.misses = self.evictions = 0
+
+    def __str__(self):
+        lookups = max(self.hits + self.misses, 1)
+        used = np.count_nonzero(self.keys)
+
+        return (f"Evaluation cache: {self.hits} hits, {self.misses} misses ({100 * self.hits / lookups:.1f}% hit rate), "
+                f"{self.evictions} evictions, {used}/{self.size} entries used")
+
+    @staticmethod
+    def cache_keys(keys, color):
+        # combine zobrist hashes with the perspective (0 is reserved for empty slots)
+
+        keys = np.asarray(keys, dtype=np.uint64) ^ PERSPECTIVE_SALTS[int(color)]
+        keys[keys == 0] = 1
+
+        return keys
+
+    def probe(self, keys):
+        # look up cache keys, returns the cached values and a mask of the keys that were found
+
+        bucket = keys & self.mask
+        in_first, in_second = self.keys[bucket] == keys, self.keys[bucket + 1] == keys
+        found = in_first | in_second
+
+        values = np.where(in_first, self.values[bucket], self.values[bucket + 1])
+
+        hits = int(np.count_nonzero(found))
+        self.hits += hits
+        self.misses += keys.size - hits
+
+        return values, found
+
+    def store(self, keys, values):
+        # add entries to the cache
+
+        bucket = keys & self.mask
+        first, second = self.keys[bucket], self.keys[bucket + 1]
+
+        to_first = (first == keys) | (first == 0)
+        to_second = ~to_first & ((second == keys) | (second == 0))
+        evict = ~to_first & ~to_second
+
+        # full bucket: the entry of the first slot moves to the second one (the older entry gets replaced)
+        evicted = bucket[evict]
+        self.keys[evicted + 1], self.values[evicted + 1] = self.keys[evicted], self.values[evicted]
+        self.evictions += evicted.size
+
+        slots = np.where(to_second, bucket + 1, bucket)
+        self.keys[slots], self.values[slots] = keys, values
+
+
+class Evaluator:
+    # evaluates board states with a model (keras model or NumpyModel)
+    # the outputs are cached by zobrist hash + perspective (for the lifetime of the evaluator, i.e. the game)
+    # prefilter: hybrid evaluation, only the best prefilter children of a position by the cheap material + piece-square-table
+    # score (and all captures/promotions) are evaluated by the model (see select_children)
+
+    def __init__(self, model, cache_size=1 << 20, source=None, prefilter=None):
+        self.model = model
+        self.source = source # (model path, backend) the model was loaded from (see registry)
+        self.prefilter = prefilter
+        self.cache = EvalCache(cache_size)
+        self.child_encoder = encoder.ChildEncoder() # reusable buffer for the tensors of all child boards of a position
+
+        self.calls = self.predicted = 0 # number of model calls and of positions sent to the model
+        self.children = self.prefiltered = 0 # number of child positions seen by the prefilter and of those it skipped
+
+    def __str__(self):
+        stats = f"{self.cache}\nModel: {self.predicted} positions evaluated in {self.calls} calls"
+
+        if self.prefilter:
+            stats += f"\nPrefilter (top {self.prefilter}): {self.prefiltered} of {self.children} child positions skipped ({100 * self.prefiltered / max(self.children, 1):.1f}%)"
+
+        return stats
+
+    def predict(self, X, verbose=0):
+        # raw model output for a batch of board tensors (not cached)
+
+        self.calls += 1
+        self.predicted += len(X)
+
+        return self.model.predict(X, verbose=verbose)
+
+    def evaluate(self, board, color):
+        # model output for a board state/position from the perspective of color
+
+        return float(self.evaluate_boards((board,), color)[0])
+
+    def evaluate_boards(self, boards, color):
+        # model outputs for several board states/positions from the perspective of color
+        # (the ones that aren't cached yet are sent to the model in one batch)
+
+        keys = EvalCache.cache_keys([zobrist.board_key(board) for board in boards], color)
+        values, found = self.cache.probe(keys)
+
+        if not found.all():
+            missing = np.flatnonzero(~found)
+
+            values[missing] = self.predict(encoder.encode_boards([boards[i] for i in missing], color)).ravel()
+            self.cache.store(keys[missing], values[missing])
+
+        return values
+
+    def evaluate_children(self, board, moves, color):
+        # model outputs for all child positions of a board (one per move) from the perspective of color
+
+        return self.evaluate_children_batch(((board, moves),), color)[0]
+
+    def select_children(self, board, moves):
+        # indices of the moves whose child positions are evaluated by the model in hybrid evaluation:
+        # the best self.prefilter moves by the change of the material + piece-square-table score
+        # (pst.move_delta, incremental) and all captures/promotions
+
+        if len(moves) <= self.prefilter: return list(range(len(moves)))
+
+        deltas = [pst.move_delta(board, move) for move in moves]
+        selected = set(sorted(range(len(moves)), key=deltas.__getitem__, reverse=True)[:self.prefilter])
+        selected.update(i for i, move in enumerate(moves) if move.promotion or board.is_capture(move))
+
+        return sorted(selected)
+
+    def evaluate_children_batch(self, parents, color):
+        # model outputs for the child positions of several boards from the perspective of color
+        # parents: (board, moves) pairs, returns one array of outputs per pair
+        # (only the children that aren't cached yet are encoded and sent to the model, all in one batch)
+        # with prefilter, the children skipped by select_children get the worst output for the player at turn
+        # (-inf/inf, so they're never chosen)
+
+        if not parents: return []
+
+        if self.prefilter:
+            selected = [self.select_children(board, moves) for board, moves in parents]
+            selected_values = self.evaluate_children_batch_all([(board, [moves[i] for i in indices]) for (board, moves), indices in zip(parents, selected)], color)
+            values = []
+
+            for (board, moves), indices, parent_values in zip(parents, selected, selected_values):
+                self.children += len(moves)
+                self.prefiltered += len(moves) - len(indices)
+
+                values.append(np.full(len(moves), -np.inf if board.turn == color else np.inf, dtype=np.float32))
+                values[-1][indices] = parent_values
+
+            return values
+
+        return self.evaluate_children_batch_all(parents, color)
+
+    def evaluate_children_batch_all(self, parents, color):
+        # model outputs for all child positions of several boards (see evaluate_children_batch)
+
+        keys = [EvalCache.cache_keys(zobrist.child_keys(board, moves), color) for board, moves in parents]
+        bounds = np.cumsum([0] + [k.size for k in keys])
+
+        keys = np.concatenate(keys)
+        values, found = self.cache.probe(keys)
+
+        if not found.all():
+            missing = np.flatnonzero(~found)
+            n = 0
+
+            for (board, moves), start, end in zip(parents, bounds[:-1], bounds[1:]):
+                parent_missing = missing[(missing >= start) & (missing < end)] - start
+                if parent_missing.size == 0: continue
+
+                self.child_encoder.encode_children(board, [moves[i] for i in parent_missing], color, offset=n)
+                n += parent_missing.size
+
+            values[missing] = self.predict(self.child_encoder.buffer[:n]).ravel()
+            self.cache.store(keys[missing], values[missing])
+
+        return np.split(values, bounds[1:-1])
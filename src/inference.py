@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import threading
+import queue
+import time
+import numpy as np
+from concurrent.futures import Future
+
+
+class InferenceService:
+    # owns 1 loaded model (keras model or NumpyModel) and evaluates the board tensors of all games/searches
+    # that use it in a background thread: requests that are queued at the same time are merged into 1 micro-batch
+    # (at most max_batch_size boards) and sent to the model together, if other requests are pending the batch
+    # waits up to max_latency seconds for more (a single client never waits, its request is sent right away)
+
+    def __init__(self, model, max_batch_size=1024, max_latency=0.002):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency # max time the first request of a batch waits for more requests (if others are pending)
+
+        self.requests = queue.Queue() # (board tensors, future) pairs, None stops the service
+        self.batches = self.predicted = self.submitted = 0 # number of model calls, boards evaluated and requests
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __str__(self):
+        return (f"Inference service: {self.submitted} requests merged into {self.batches} batches "
+                f"({self.predicted / max(self.batches, 1):.1f} boards per batch)")
+
+    def submit(self, X):
+        # queue a batch of board tensors, returns a future of the model output
+
+        future = Future()
+        self.requests.put((np.asarray(X, dtype=np.float32), future))
+
+        return future
+
+    def predict(self, X, verbose=0):
+        # blocking model output for a batch of board tensors (same interface as keras' Model.predict)
+
+        return self.submit(X).result()
+
+    def close(self):
+        # stop the service once all queued requests are done
+
+        self.requests.put(None)
+        self.thread.join()
+
+    def collect(self, request):
+        # collect requests until the batch is full, the queue is empty (or max_latency has passed if other requests
+        # were pending, i.e. several clients are active) or the service is stopped
+        # returns the requests of the batch and whether the service should keep running
+
+        batch, size = [request], len(request[0])
+        wait = not self.requests.empty()
+        deadline = time.monotonic() + self.max_latency
+
+        while size < self.max_batch_size:
+            try:
+                if wait: request = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+                else: request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+
+            if request is None: return batch, False
+
+            batch.append(request)
+            size += len(request[0])
+
+        return batch, True
+
+    def run(self):
+        # evaluate the queued requests batch by batch
+
+        running = True
+
+        while running:
+            request = self.requests.get()
+            if request is None: break
+
+            batch, running = self.collect(request)
+            X = np.concatenate([X for X, _ in batch]) if len(batch) > 1 else batch[0][0]
+
+            try:
+                y = self.model.predict(X, verbose=0)
+            except Exception as e:
+                for _, future in batch: future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.predicted += len(X)
+            self.submitted += len(batch)
+
+            start = 0
+
+            for X, future in batch:
+                future.set_result(y[start:start + len(X)])
+                start += len(X)
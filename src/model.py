@@ -2,8 +2,38 @@
 
 import tensorflow as tf
 import numpy as np
+import argparse
+from time import perf_counter
 from tensorflow.keras import layers
 from pathlib import Path
+import encoder
+from dataset import ShardedDataset, DatasetView
+from tflite_model import TFLiteModel
+
+
+class DatasetSequence(tf.keras.utils.Sequence):
+    # feeds the batches of a DatasetView (sharded dataset) to keras
+
+    def __init__(self, data, batch_size, shuffle=False):
+        super().__init__()
+        self.data = data
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.order = np.arange(len(data))
+
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.data) / self.batch_size))
+
+    def __getitem__(self, i):
+        # read the samples of batch i from the shards
+        # (sorted positions -> memory map is read mostly sequentially)
+
+        return self.data.take(np.sort(self.order[i*self.batch_size:(i+1)*self.batch_size]))
+
+    def on_epoch_end(self):
+        if self.shuffle: np.random.shuffle(self.order)
 
 
 class Model:
@@ -23,10 +53,21 @@ class Model:
     
     def load_data(self, data_path, test_size=0.2):
         # load the data generated by the PGNParser class
+
+        shards_path = data_path + "training_data_" + str(self.train_data_size)
+
+        if ShardedDataset.exists(shards_path):
+            # sharded dataset: open the shards as memory maps and split them into
+            # a train and a test view (index arrays, the labels are part of the views)
+            train_data, test_data = ShardedDataset(shards_path).split(test_size)
+
+            return train_data, None, test_data, None
         
-        data = np.load(data_path + "training_data_" + str(self.train_data_size) + ".npz")
+        data = np.load(shards_path + ".npz")
         X, y = data["X"], data["y"]
 
+        if X.ndim == 2: X = encoder.unpack_boards(X) # bit-packed samples
+
         # randomly draw test_size of the total samples as a test set
         random_test_samples = np.random.choice(np.arange(X.shape[0]), int(test_size * X.shape[0]), replace=False)
         test_sample_mask = np.zeros(X.shape[0], dtype=bool)
@@ -60,31 +101,173 @@ class Model:
 
         return model
     
-    def train(self, X_train=None, y_train=None):
+    def train(self, X_train=None, y_train=None, streaming=False):
         # train the neural nework
+        # (streaming: read a sharded dataset lazily through a tf.data pipeline, see stream_data)
+
+        if X_train is None: X_train = self.X_train
+        if y_train is None: y_train = self.y_train
+
+        if isinstance(X_train, DatasetView):
+            # sharded dataset: read the batches from the shards while training
+            # (20% of the training samples are held out for validation)
+            X_train, X_val = X_train.split(0.2)
 
-        if not X_train: X_train = self.X_train
-        if not y_train: y_train = self.y_train
+            if streaming: self.model.fit(self.stream_data(X_train, shuffle=True), validation_data=self.stream_data(X_val), epochs=5, verbose=2)
+            else: self.model.fit(DatasetSequence(X_train, 128, shuffle=True), validation_data=DatasetSequence(X_val, 128), epochs=5, verbose=2)
+        else:
+            self.model.fit(X_train, y_train, epochs=5, batch_size=128, validation_split=0.2, shuffle=True, verbose=2)
 
-        self.model.fit(X_train, y_train, epochs=5, batch_size=128, validation_split=0.2, shuffle=True, verbose=2)
+    @staticmethod
+    def stream_data(data, batch_size=128, shuffle=False, shuffle_buffer=10000, block_size=1024, cycle_length=4):
+        # create a tf.data pipeline that lazily streams the samples of a DatasetView (sharded dataset):
+        # blocks of up to block_size samples (each from a single shard) are read by cycle_length parallel readers
+        # and interleaved, shuffled (if shuffle), batched, decoded to 8x8x6 tensors in parallel and prefetched
+
+        dataset = data.dataset
+        blocks = data.blocks(block_size)
+
+        def read_block(block):
+            return dataset.read(blocks[block])
+
+        def read_samples(block):
+            X, y = tf.numpy_function(read_block, [block], [tf.as_dtype(dataset.dtype), tf.uint8])
+            X.set_shape((None,) + dataset.stored_shape)
+            y.set_shape((None,))
+
+            return tf.data.Dataset.from_tensor_slices((X, y))
+
+        def decode(X, y):
+            if dataset.packed:
+                # unpack the 12 bitboards of every sample (see encoder.unpack_boards)
+                bits = tf.bitwise.bitwise_and(tf.bitwise.right_shift(X[:, :, None], tf.constant(np.arange(64, dtype=np.uint64))), 1)
+                bits = tf.reshape(tf.cast(bits, tf.float32), (-1, 2, 6, 8, 8))
+                X = tf.transpose(bits[:, 0] - bits[:, 1], (0, 2, 3, 1))
+
+            return tf.cast(X, tf.float32), tf.cast(y, tf.float32)
+
+        stream = tf.data.Dataset.range(len(blocks))
+
+        if shuffle: stream = stream.shuffle(len(blocks))
+
+        stream = stream.interleave(read_samples, cycle_length=cycle_length, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+
+        if shuffle: stream = stream.shuffle(shuffle_buffer)
+
+        return stream.batch(batch_size).map(decode, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
     
     def evaluate(self, X_test=None, y_test=None):
         # test the accuracy of the trained neural network
 
-        if not X_test: X_test = self.X_test
-        if not y_test: y_test = self.y_test
+        if X_test is None: X_test = self.X_test
+        if y_test is None: y_test = self.y_test
 
-        res = self.model.evaluate(X_test, y_test, verbose=2)
+        if isinstance(X_test, DatasetView): res = self.model.evaluate(self.stream_data(X_test), verbose=2)
+        else: res = self.model.evaluate(X_test, y_test, verbose=2)
 
         print(res)
     
     def save(self, name):
         self.model.save(self.model_path + name)
 
+    def load(self, name):
+        # load a previously saved model (instead of the newly created one)
+
+        self.model = tf.keras.models.load_model(self.model_path + name)
+
+    @staticmethod
+    def sample(X, y, n, rng):
+        # draw n random samples (from arrays or a DatasetView)
+
+        positions = np.sort(rng.choice(len(X), min(n, len(X)), replace=False))
+
+        if isinstance(X, DatasetView): return X.take(positions)
+
+        return X[positions], y[positions]
+
+    @staticmethod
+    def measure_latency(model, X, repeats=50):
+        # median time (in ms) of a prediction of the batch X
+
+        model.predict(X, verbose=0) # warm up
+        times = []
+
+        for _ in range(repeats):
+            start = perf_counter()
+            model.predict(X, verbose=0)
+            times.append(perf_counter() - start)
+
+        return 1000 * np.median(times)
+
+    def export_quantized(self, name, float16=False, calibration_size=1000, seed=0):
+        # export post-training quantized versions of the model for cpu inference (see TFLiteModel):
+        # model/name/int8.tflite (int8 weights and activations, calibrated on calibration_size training samples)
+        # and model/name/float16.tflite (float16 weights, if float16)
+        # prints the accuracy on the test split and the latency compared to the float32 model
+
+        rng = np.random.default_rng(seed)
+        X_calibration, _ = self.sample(self.X_train, self.y_train, calibration_size, rng)
+
+        def representative_data():
+            for X in X_calibration: yield [X[None].astype(np.float32)]
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_data
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+        model_files = {"int8": Path(self.model_path, name, "int8.tflite")}
+        model_files["int8"].write_bytes(converter.convert())
+
+        if float16:
+            converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+
+            model_files["float16"] = Path(self.model_path, name, "float16.tflite")
+            model_files["float16"].write_bytes(converter.convert())
+
+        # compare the quantized models to the float32 model
+        # (accuracy: output > 0.5 <-> "good" board state, like keras' accuracy metric for 1 output neuron)
+
+        if isinstance(self.X_test, DatasetView): X_test, y_test = self.X_test.take(np.arange(len(self.X_test)))
+        else: X_test, y_test = self.X_test, self.y_test
+
+        models = {"float32": self.model}
+        models.update({kind: TFLiteModel(model_file) for kind, model_file in model_files.items()})
+
+        for kind, model in models.items():
+            y_pred = np.concatenate([model.predict(X_test[i:i+1024], verbose=0) for i in range(0, len(X_test), 1024)]).ravel()
+            accuracy = np.mean((y_pred > 0.5) == y_test)
+
+            if kind == "float32": float_accuracy, float_latency = accuracy, {}
+
+            print(f"{kind}: test accuracy {accuracy:.4f} ({accuracy - float_accuracy:+.4f})", end="")
+
+            for batch_size in (1, 32):
+                latency = self.measure_latency(model, X_test[:batch_size])
+
+                if kind == "float32": float_latency[batch_size] = latency
+                print(f", batch size {batch_size}: {latency:.3f} ms ({float_latency[batch_size] / latency:.1f}x)", end="")
+
+            print(f", {model_files[kind].stat().st_size / 1024:.0f} KiB" if kind in model_files else "")
+
 if __name__ == "__main__":
-    model = Model(train_data_size=1000000)
-    model.train()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quantize", metavar="NAME", type=str, help="only export quantized versions of the saved model NAME (see Model.export_quantized)")
+    parser.add_argument("--data-size", metavar="N", type=int, default=1000000, help="size of the training data (see PGNParser)")
 
-    model.evaluate()
-    
-    model.save("chess_model_v2")
\ No newline at end of file
+    args = parser.parse_args()
+
+    model = Model(train_data_size=args.data_size)
+
+    if args.quantize:
+        model.load(args.quantize)
+        model.export_quantized(args.quantize, float16=True)
+    else:
+        model.train(streaming=True)
+
+        model.evaluate()
+        
+        model.save("chess_model_v2")
+        model.export_quantized("chess_model_v2", float16=True)
\ No newline at end of file
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import chess
+
+
+class NegativeSampler:
+    # generates "bad" board states for the training data by playing random moves
+    # (replacement for the loser's moves, see PGNParser.encode_game)
+
+    def __init__(self, n=1, legal_only=False):
+        self.n = n # number of "bad" board states generated per position
+        self.legal_only = legal_only # only play legal moves (default: pseudo-legal moves, like the moves the model gets to see)
+
+    def sample(self, board, rng):
+        # play self.n random moves on copies of the board and return the resulting boards
+        # (different moves if the position has enough of them)
+
+        moves = list(board.legal_moves if self.legal_only else board.pseudo_legal_moves)
+
+        if self.n == 1: chosen = (rng.randint(0, len(moves)),)
+        else: chosen = rng.choice(len(moves), self.n, replace=self.n > len(moves))
+
+        bad_boards = []
+
+        for k in chosen:
+            bad_board = board.copy(stack=False)
+            bad_board.push(moves[k])
+            bad_boards.append(bad_board)
+
+        return bad_boards
+
+    def samples_per_game(self, winner, total_moves):
+        # number of samples a game results in: 1 "good" sample for every move of the winner
+        # and self.n "bad" samples for every move of the loser
+
+        winner_moves = (total_moves + 1) // 2 if winner == chess.WHITE else total_moves // 2
+
+        return winner_moves + self.n * (total_moves - winner_moves)
+
+    def settings(self):
+        # settings that change the generated samples (part of the build cache keys)
+
+        return {"negatives": self.n, "legal_only": self.legal_only}
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import json
+import numpy as np
+from pathlib import Path
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0, out=x),
+    "tanh": lambda x: np.tanh(x, out=x),
+    "sigmoid": lambda x: np.divide(1, 1 + np.exp(-x), out=x),
+}
+
+
+class NumpyModel:
+    # runs the forward pass of a saved keras model (Conv2D/MaxPooling2D/Flatten/Dense layers)
+    # in numpy (float32), so no tensorflow is needed to play
+    # (the weights are read from model_path/weights.npz, see export_weights)
+
+    patch_index_cache = {} # see patch_indices
+
+    def __init__(self, model_path):
+        weights_path = Path(model_path).joinpath("weights.npz")
+
+        if not weights_path.is_file(): self.export_weights(model_path)
+
+        weights = np.load(weights_path)
+
+        self.layers = json.loads(str(weights["layers"]))
+        self.weights = [(weights[f"w{i}"], weights[f"b{i}"]) if f"w{i}" in weights else None for i in range(len(self.layers))]
+
+        # convolution kernels are used as (kernel_h * kernel_w * channels_in, channels_out) matrices (see conv2d)
+        for i, layer in enumerate(self.layers):
+            if layer["type"] == "conv":
+                w, b = self.weights[i]
+                self.weights[i] = (w.reshape(-1, w.shape[-1]), b)
+
+    @staticmethod
+    def export_weights(model_path):
+        # store the weights and the layer structure of a saved keras model in model_path/weights.npz
+        # (only needed once per model, requires tensorflow)
+
+        from tensorflow import keras
+
+        model = keras.models.load_model(model_path)
+        layers, weights = [], {}
+
+        for i, layer in enumerate(model.layers):
+            config = layer.get_config()
+            kind = type(layer).__name__
+
+            if kind == "Conv2D":
+                if config["padding"] != "same" or tuple(config["strides"]) != (1, 1): raise ValueError(f"unsupported convolution in layer '{layer.name}'")
+                layers.append({"type": "conv", "activation": config["activation"]})
+            elif kind == "MaxPooling2D":
+                layers.append({"type": "pool", "pool_size": list(config["pool_size"])})
+            elif kind == "Flatten":
+                layers.append({"type": "flatten"})
+            elif kind == "Dense":
+                layers.append({"type": "dense", "activation": config["activation"]})
+            else:
+                raise ValueError(f"unsupported layer '{layer.name}' ({kind})")
+
+            if layer.get_weights(): weights[f"w{i}"], weights[f"b{i}"] = (w.astype(np.float32) for w in layer.get_weights())
+
+        np.savez(Path(model_path).joinpath("weights.npz"), layers=json.dumps(layers), **weights)
+
+    @staticmethod
+    def patch_indices(h, w, k):
+        # indices of the k x k neighbourhood of every position of a (h, w) grid (flattened),
+        # positions outside of the grid point to index h * w (a row of zeros -> "same" padding)
+
+        if (h, w, k) not in NumpyModel.patch_index_cache:
+            p = k // 2
+            rows = np.arange(h)[:, None, None, None] + np.arange(k)[None, None, :, None] - p
+            cols = np.arange(w)[None, :, None, None] + np.arange(k)[None, None, None, :] - p
+
+            indices = np.where((rows >= 0) & (rows < h) & (cols >= 0) & (cols < w), rows * w + cols, h * w)
+            NumpyModel.patch_index_cache[(h, w, k)] = indices.reshape(h * w, k * k)
+
+        return NumpyModel.patch_index_cache[(h, w, k)]
+
+    @staticmethod
+    def conv2d(X, kernel, bias):
+        # 2d convolution with "same" padding and stride 1
+        # (im2col: gather the patches of the whole batch, then 1 matrix multiplication)
+
+        n, h, w, c = X.shape
+        k = int(np.sqrt(kernel.shape[0] // c)) # kernel size
+
+        X = np.concatenate((X.reshape(n, h * w, c), np.zeros((n, 1, c), dtype=X.dtype)), axis=1)
+        patches = X[:, NumpyModel.patch_indices(h, w, k)] # (n, h * w, k * k, c)
+
+        return (patches.reshape(n * h * w, k * k * c) @ kernel + bias).reshape(n, h, w, -1)
+
+    @staticmethod
+    def max_pool2d(X, pool_size):
+        # max pooling with stride = pool size and "valid" padding
+
+        n, h, w, c = X.shape
+        ph, pw = pool_size
+
+        X = X[:, :h - h % ph, :w - w % pw]
+
+        return X.reshape(n, h // ph, ph, w // pw, pw, c).max(axis=(2, 4))
+
+    def predict(self, X, verbose=0):
+        # calculate the model output for a batch of board tensors (same interface as keras' Model.predict)
+
+        X = np.asarray(X, dtype=np.float32)
+
+        for layer, weights in zip(self.layers, self.weights):
+            if layer["type"] == "conv":
+                X = ACTIVATIONS[layer["activation"]](self.conv2d(X, *weights))
+            elif layer["type"] == "pool":
+                X = self.max_pool2d(X, layer["pool_size"])
+            elif layer["type"] == "flatten":
+                X = X.reshape(X.shape[0], -1)
+            else:
+                w, b = weights
+                X = ACTIVATIONS[layer["activation"]](X @ w + b)
+
+        return X
@@ -3,13 +3,132 @@
 import chess
 import chess.pgn
 import os
+import json
+import shutil
+import hashlib
+import multiprocessing
 import numpy as np
+import encoder
+from collections import deque
+from itertools import count, islice
+from dataset import ShardWriter, ShardedDataset
+from dedup import PositionSet, sample_key
+from negatives import NegativeSampler
 from pathlib import Path
 
+class GameMoves(chess.pgn.BaseVisitor):
+    # visitor for chess.pgn.read_game that only collects the starting board, the winner and the mainline moves of a game
+    # (games without a winner are skipped before their moves get parsed and no game tree is built)
+
+    def begin_game(self):
+        self.board = None
+        self.winner = None
+        self.moves = []
+
+    def visit_header(self, tagname, tagvalue):
+        if tagname == "Result":
+            if tagvalue == "1-0": self.winner = chess.WHITE
+            elif tagvalue == "0-1": self.winner = chess.BLACK
+
+    def end_headers(self):
+        if self.winner is None: return chess.pgn.SKIP
+
+    def visit_board(self, board):
+        # first call is the starting position of the game
+        if self.board is None: self.board = board.copy(stack=False)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        self.moves.append(move)
+
+    def handle_error(self, error):
+        # like the default GameBuilder: keep the moves up to the error
+        pass
+
+    def result(self):
+        return self.board, self.winner, self.moves
+
+
+class SampleBuffer:
+    # growable output arrays for the encoded board states (X) and their labels (y)
+
+    def __init__(self, capacity=1024, packed=False, keys=False, max_capacity=None):
+        self.packed = packed # store bit-packed samples (see encoder.pack_boards) instead of 8x8x6 tensors
+        self.max_capacity = max_capacity # the capacity never grows beyond this (unless more samples are reserved)
+        if max_capacity is not None: capacity = min(capacity, max_capacity)
+        self.X, self.y = PGNParser.empty_samples(capacity, packed)
+        self.keys = np.empty(capacity, dtype=np.uint64) if keys else None # keys of the samples (see dedup.sample_key)
+        self.size = 0 # number of samples stored so far
+
+    def reserve(self, n):
+        # make sure n more samples fit into the arrays (doubles the capacity if they don't, up to max_capacity)
+
+        if self.size + n > self.y.size:
+            capacity = 2 * self.y.size
+            if self.max_capacity is not None: capacity = min(capacity, self.max_capacity)
+            capacity = max(capacity, self.size + n)
+
+            X, y = PGNParser.empty_samples(capacity, self.packed)
+            X[:self.size], y[:self.size] = self.X[:self.size], self.y[:self.size]
+            self.X, self.y = X, y
+
+            if self.keys is not None: self.keys = np.concatenate((self.keys[:self.size], np.empty(capacity - self.size, dtype=np.uint64)))
+
+    def append(self, X, y, keys=None):
+        # add samples (and their keys) at the end of the arrays
+
+        self.reserve(len(y))
+
+        self.X[self.size:self.size+len(y)], self.y[self.size:self.size+len(y)] = X, y
+        if self.keys is not None: self.keys[self.size:self.size+len(y)] = keys
+
+        self.size += len(y)
+
+    def drop_duplicates(self, start, positions):
+        # remove all samples after index start whose keys are already in positions (and add the others to it)
+        # returns the number of dropped samples
+
+        new = positions.add(self.keys[start:self.size])
+        kept = int(np.count_nonzero(new))
+
+        self.X[start:start+kept] = self.X[start:self.size][new]
+        self.y[start:start+kept] = self.y[start:self.size][new]
+        self.keys[start:start+kept] = self.keys[start:self.size][new]
+
+        dropped = self.size - start - kept
+        self.size = start + kept
+
+        return dropped
+
+    def arrays(self):
+        # the stored samples (without the unused capacity)
+        # (copies if more than a quarter of the capacity is unused, views would keep all of it alive)
+
+        if 4 * (self.y.size - self.size) > self.y.size: return self.X[:self.size].copy(), self.y[:self.size].copy()
+
+        return self.X[:self.size], self.y[:self.size]
+
+
 class PGNParser:
-    def __init__(self, auto=True, max_size=10000):
+    # version of the sample encoding (part of the build cache keys, increase it whenever encode_game changes)
+    encoding_version = 1
+
+    def __init__(self, auto=True, max_size=10000, workers=1, chunk_size=200, seed=None, packed=False, dedup=False, cache=False,
+                 negatives=1, legal_negatives=False):
         self.max_size = max_size # maximum size of samples to be stored in X (training data)
-        self.size = 0 # will be set after parge_pgn() gets called in parse_pgns()
+        self.size = 0 # will be set in parse_pgns()
+        self.workers = workers # number of processes used to parse the pgns (1: parse everything in this process)
+        self.chunk_size = chunk_size # number of games encoded per task if multiple workers are used
+        self.seed = seed # seed for the random ("bad") moves (makes the training data reproducible)
+        self.seed_sequence = np.random.SeedSequence(seed) # every chunk of games gets its own rng (see chunk_seed)
+        self.packed = packed # store every board state as 12 bit-packed bitboards (96 bytes) instead of a 8x8x6 tensor (384 bytes)
+        self.dedup = dedup # drop samples whose board state (zobrist hash) and label were already seen
+        self.positions = PositionSet() if dedup else None # keys of all samples seen so far
+        self.duplicates = {} # number of dropped duplicate samples per pgn file
+        self.cache = cache # encode every pgn file completely and store it in a build cache (only new or changed files get encoded)
+        self.sampler = NegativeSampler(negatives, legal_negatives) # generates the "bad" board states (negatives per position, only legal moves?)
 
         if auto:
             # path to data folder containing all games in pgn format
@@ -17,200 +136,389 @@ class PGNParser:
             self.X, self.y = self.parse_pgns(self.data_path) # store every board state as well as the "goodness" of the state
 
     def parse_pgns(self, pgn_dir):
-            # store the board states and their associated "goodness" values
-            # for every pgn avaiable in the database
-            
-            # parse every pgn (containing multiple games) and store each game as well as the winner
-            pgns = []
-            for pgn_file in os.listdir(pgn_dir):
-                if pgn_file.endswith(".pgn"):
-                    pgn = self.parse_pgn(pgn_dir + pgn_file)
-                    if pgn: pgns.append(pgn)
+        # store the board states and their associated "goodness" values
+        # for every pgn avaiable in the database
 
-            X = np.empty((self.size, 8, 8, 6), dtype=np.int8)
-            y = np.empty(self.size, dtype=np.uint8)
+        if self.cache: return self.parse_pgns_cached(pgn_dir)
+        if self.workers > 1: return self.parse_pgns_parallel(pgn_dir)
 
-            i = 0 # counter for all board states added to X
+        pgn_files = [pgn_dir + pgn_file for pgn_file in sorted(os.listdir(pgn_dir)) if pgn_file.endswith(".pgn")]
 
-            for fc, pgn in enumerate(pgns, 1):
-                for gc, game in enumerate(pgn, 1):
+        # the games are streamed one at a time straight into the (growable) output arrays
+        samples = SampleBuffer(packed=self.packed, keys=self.dedup, max_capacity=self.max_size + 512 * self.sampler.n) # (+ some room for the last game)
 
-                    if gc % 10 == 0: print(f"[File {fc}/{len(pgns)}] Parsing game {gc}/{len(pgn)} resulting in checkmate ({i} board state samples generated)\n")
+        for fc, pgn_file in enumerate(pgn_files, 1):
+            if samples.size >= self.max_size: break
 
-                    game_board = game[0].board() # the game board (contains all moves played during the current game)
-                    random_board = chess.Board() # a random board to execute random moves as a replacement for the loser's moves
+            self.parse_pgn(pgn_file, samples, f"[File {fc}/{len(pgn_files)}]", fc - 1)
 
-                    winner = game[1]
+        self.size = samples.size
 
-                    moves_played = tuple(game[0].mainline_moves()) # get all moves played during the game
+        return samples.arrays()
 
-                    # figure out who won the game
-                    if winner == chess.WHITE:
-                        # if white won, all even moves by index (move 0, move 2, move 4 etc.) are "good" moves
+    def parse_pgns_parallel(self, pgn_dir):
+        # same as parse_pgns, but spreads the work across a pool of self.workers processes:
+        # this process only finds the file offsets of every self.chunk_size games (chess.pgn.skip_game, no move parsing),
+        # the workers read and encode these chunks of games (every game is only parsed once)
+        # at most 2 chunks per worker are queued and no new ones once self.max_size samples are reached
+        # the games of every chunk are added in file/game order and every chunk gets its own seeded rng,
+        # so the result only depends on self.seed (not on the number of workers or the scheduling,
+        # parse_pgns uses the same chunks and seeds and gets the same result)
 
-                        good_move_start = 0
-                        offset = 1 if len(moves_played) % 2 != 0 else 0
-                    else:
-                        # if black won, all uneven moves by index (move 1, move 3, move 5 etc.) are "good" moves
-                        # since loop over moves below starts at the index of the first "good" move,
-                        # and black won this game, white's opener has to be labeled as a "bad" move
+        pgn_files = [pgn_dir + pgn_file for pgn_file in sorted(os.listdir(pgn_dir)) if pgn_file.endswith(".pgn")]
+        samples = SampleBuffer(packed=self.packed, keys=self.dedup, max_capacity=self.max_size + 512 * self.sampler.n)
 
-                        good_move_start = 1
-                        offset = 0 if len(moves_played) % 2 != 0 else 1
+        print(f"Reading games from {len(pgn_files)} PGN files using {self.workers} workers (this might take a few seconds)...")
 
-                        random_move = tuple(random_board.pseudo_legal_moves)[np.random.randint(0, random_board.pseudo_legal_moves.count())]
-                        random_board.push(random_move)
-                        bad_board_state = self.convert_board_to_tensor(random_board, chess.WHITE)
+        with multiprocessing.Pool(self.workers) as pool:
+            tasks = ((pgn_file, offset, self.chunk_size, self.chunk_seed(fi, chunk), self.packed, self.dedup, self.sampler)
+                     for fi, pgn_file, chunk, offset in self.game_chunks(pgn_files))
+            pending = deque((task[0], pool.apply_async(PGNParser.encode_chunk, (task,))) for task in islice(tasks, 2 * self.workers))
+            cc = 0 # chunks added so far
 
-                        game_board.push(moves_played[0]) # play the 1st move since the loop starts at index 1 instead of 0
+            while pending and samples.size < self.max_size:
+                pgn_file, result = pending.popleft()
+                X, y, keys, ends = result.get()
+                pending.extend((task[0], pool.apply_async(PGNParser.encode_chunk, (task,))) for task in islice(tasks, 1))
 
-                        X[i] = bad_board_state
-                        y[i] = 0
-                        i += 1
+                # add the games until self.max_size is reached (like parse_pgn)
+                for start, end in zip([0] + ends, ends):
+                    if samples.size >= self.max_size: break
 
-                    for move in range(good_move_start, len(moves_played) - offset, 2):
-                        # convert board states to 6x8x8 tensor and label it correctly ("good"/"bad" move)
-                        # for bad moves, make a random move from all possible moves of the current board state 
-                        # (because all games are GrandMaster games and thus (early) moves are not necessarily bad)
+                    samples.append(X[start:end], y[start:end], keys[start:end] if self.dedup else None)
 
-                        # set the random board (for the random, "bad" moves) to the current state of the game board,
-                        # execute a random "bad" move and convert the resulting board state to a tensor 
-                        random_board.set_fen(game_board.fen())
-                        random_move = tuple(random_board.pseudo_legal_moves)[np.random.randint(0, random_board.pseudo_legal_moves.count())]
-                        random_board.push(random_move)
+                    if self.dedup:
+                        dropped = samples.drop_duplicates(samples.size - (end - start), self.positions)
+                        self.duplicates[pgn_file] = self.duplicates.get(pgn_file, 0) + dropped
 
-                        bad_board_state = self.convert_board_to_tensor(random_board, winner)
+                cc += 1
+                if cc % 10 == 0: print(f"Encoded chunk {cc} ({samples.size} board state samples generated)\n")
 
-                        # play the next move of the game and convert the resulting board state to a tensor
-                        
-                        game_board.push(moves_played[move])
-                        good_board_state = self.convert_board_to_tensor(game_board, winner)
+        # (leaving the with block terminates the workers, chunks still in the queue are dropped)
 
-                        # play the next move as well (for which we did a random move) so the board stays correct
-                        game_board.push(moves_played[move+1]) 
+        print(f"Finished! Encoded {cc} chunks of games ({samples.size} board state samples generated)\n")
 
-                        X[i] = good_board_state
-                        y[i] = 1 # "good" moves get a 1
+        for pgn_file, dropped in self.duplicates.items(): print(f"Dropped {dropped} duplicate board states from '{pgn_file}'")
 
-                        X[i+1] = bad_board_state
-                        y[i+1] = 0 # "bad" moves get a 0 
+        self.size = samples.size
 
-                        i += 2
-                    
-                    if offset:
-                        # edge case: loop above increments by 2 every iteration
-                        # -> in some cases the last move will not be executed in the loop
-                        # -> has to be "manually" executed outside of the loop
+        return samples.arrays()
 
-                        move += 2
-                        game_board.push(moves_played[move])
+    def game_chunks(self, pgn_files):
+        # yields the file index, the file, the chunk index and the file offset of every self.chunk_size games of the pgn files
+        # (only finds where the games start, without parsing them)
 
-                        # the last move of a checkmate game is always the winning move
-                        good_board_state = self.convert_board_to_tensor(game_board, winner)
-                        X[i] = good_board_state
-                        y[i] = 1
+        for fi, pgn_file in enumerate(pgn_files):
+            try:
+                with open(pgn_file) as pgn:
+                    for chunk in count():
+                        offset = pgn.tell()
+                        if not chess.pgn.skip_game(pgn): break
 
-                        i += 1
+                        yield fi, pgn_file, chunk, offset
 
-            print(f"[File {fc}/{len(pgns)}] Finished! Parsed {gc}/{len(pgn)} games resulting in checkmate ({i} board state samples generated)\n")
+                        for _ in range(self.chunk_size - 1):
+                            if not chess.pgn.skip_game(pgn): break
 
-            return X, y        
+            except Exception as e:
+                self.read_error(pgn_file, e)
 
-    def parse_pgn(self, pgn_file):
-        # read a pgn file containing multiple games
-        # and find the winner of every game in order
-        # to assign a "goodness" value for every move
+    def chunk_seed(self, file_index, chunk):
+        # seed of the rng of a chunk of games (chunks: self.chunk_size consecutive games of a pgn file, valid or not)
 
-        print(f"Reading games from PGN file '{pgn_file}' (this might take a few seconds)...")
-        games = []
+        return np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=(file_index, chunk))
 
-        try:
-            pgn = open(pgn_file)
-            game = chess.pgn.read_game(pgn) # read the first game
+    def parse_pgns_cached(self, pgn_dir):
+        # same as parse_pgns, but every pgn file is encoded completely and stored in a build cache (pgn_dir/cache/),
+        # keyed by the content hash of the file and the encoder settings
+        # -> a rebuild only encodes new or changed files (using self.workers processes)
+        # and concatenates the cached samples of all files (in file order) into the final dataset
+
+        cache_dir = Path(pgn_dir).joinpath("cache")
+        pgn_files = [pgn_dir + pgn_file for pgn_file in sorted(os.listdir(pgn_dir)) if pgn_file.endswith(".pgn")]
+
+        entries = [(pgn_file,) + self.cache_entry(pgn_file, cache_dir) for pgn_file in pgn_files]
+        missing = [(pgn_file, path, seed) for pgn_file, path, seed in entries if not ShardedDataset.exists(path)]
+
+        print(f"Found {len(entries) - len(missing)}/{len(entries)} PGN files in the build cache, encoding {len(missing)} PGN files...")
+
+        tasks = [(pgn_file, seed, self.packed, self.sampler) for pgn_file, path, seed in missing]
+
+        # encode the missing files (one file per worker)
+        if self.workers > 1 and len(tasks) > 1:
+            with multiprocessing.Pool(self.workers) as pool: self.write_cache(missing, pool.imap(PGNParser.encode_pgn, tasks), cache_dir)
+        else:
+            self.write_cache(missing, map(PGNParser.encode_pgn, tasks), cache_dir)
+
+        X, y = [], []
+
+        for pgn_file, path, seed in entries:
+            if self.size >= self.max_size: break
+
+            cached = ShardedDataset(path) # (memory-mapped, only the samples that are used get read)
+            if len(cached) == 0: continue # file without valid (decisive) games
+
+            indices = np.arange(len(cached))
+
+            if self.dedup:
+                new = self.positions.add(np.load(path.joinpath("keys.npy"), mmap_mode="r"))
+                indices = indices[new]
+
+                self.duplicates[pgn_file] = new.size - indices.size
+                print(f"Dropped {self.duplicates[pgn_file]} duplicate board states from '{pgn_file}'")
 
-            while game != None and self.size < self.max_size:
-                res = game.headers["Result"]
+            X_file, y_file = cached.read(indices[:self.max_size - self.size])
+            X.append(X_file)
+            y.append(y_file)
+            self.size += len(y_file)
 
-                """
-                match res:
-                    case "1-0": winner = chess.WHITE
-                    case "0-1": winner = chess.BLACK
-                    case _: winner = None
-                """
+        return np.concatenate(X) if X else self.empty_samples(0, self.packed)[0], np.concatenate(y) if y else np.empty(0, dtype=np.uint8)
 
-                if res == "1-0": winner = chess.WHITE
-                elif res == "0-1": winner = chess.BLACK
-                else: winner = None
-                
-                total_moves = len(tuple(game.mainline_moves())) # total moves of this game
+    def write_cache(self, missing, results, cache_dir):
+        # store the encoded samples (results of encode_pgn) of the missing files in the build cache
 
-                if winner is not None and total_moves >= 2: 
-                    # store the current game and winner 
-                    # (only if game ended in checkmate and game was "valid" 
-                    # ( -> min. 2 moves; sometimes PGN contains falsely formatted games))
+        for (pgn_file, path, seed), (X, y, keys) in zip(missing, results):
+            # remove outdated cache entries of the file (same settings, different content)
+            for old_path in cache_dir.glob(path.name[:path.name.rindex("-")] + "-*"): shutil.rmtree(old_path)
 
-                    self.size +=  total_moves # add number of moves of current game to total size of X
-                    games.append((game, winner))
+            writer = ShardWriter(path, max(len(y), 1), self.packed)
+            writer.write(X, y)
+            writer.close()
+            np.save(path.joinpath("keys.npy"), keys)
 
-                game = chess.pgn.read_game(pgn) # read the next game
+            print(f"Encoded {len(y)} board state samples from '{pgn_file}' into the build cache\n")
 
-            
-            pgn.close()
+    def cache_entry(self, pgn_file, cache_dir):
+        # path of the build cache entry of a pgn file (keyed by the content hash of the file and the encoder settings)
+        # and the seed for the random moves of the file (depends on the content, so the result doesn't depend on the other files)
+
+        content_hash = hashlib.sha256()
+
+        with open(pgn_file, "rb") as fin:
+            for block in iter(lambda: fin.read(1 << 20), b""): content_hash.update(block)
+
+        content_hash = content_hash.hexdigest()
+        settings = json.dumps(dict(encoding=self.encoding_version, packed=self.packed, seed=self.seed, **self.sampler.settings()), sort_keys=True)
+
+        path = cache_dir.joinpath(f"{Path(pgn_file).stem}-{hashlib.sha256(settings.encode()).hexdigest()[:8]}-{content_hash[:16]}")
+        seed = np.random.SeedSequence(None if self.seed is None else [self.seed, int(content_hash[:16], 16)])
+
+        return path, seed
+
+    @staticmethod
+    def encode_pgn(task):
+        # encode all valid games of a pgn file (for the build cache)
+        # (returns X, y and the keys of all samples)
+
+        pgn_file, seed, packed, sampler = task
+        rng = np.random.RandomState(np.random.MT19937(seed))
+        samples = SampleBuffer(packed=packed, keys=True)
+
+        with open(pgn_file) as pgn:
+            for _, board, winner, moves_played in PGNParser.read_games(pgn):
+                samples.reserve(sampler.samples_per_game(winner, len(moves_played)))
+                samples.size = PGNParser.encode_game(board, winner, moves_played, samples.X, samples.y, samples.size, rng, packed, samples.keys, sampler)
+
+        X, y = samples.arrays()
+
+        return X, y, samples.keys[:samples.size]
+
+    @staticmethod
+    def encode_game(game_board, winner, moves_played, X, y, i, rng, packed=False, keys=None, sampler=None):
+        # convert all board states of a game (starting at game_board, which is modified)
+        # to tensors (or bit-packed bitboards) and write them (and their labels) into X and y, starting at index i
+        # (and their keys for the deduplication into keys, if provided)
+        # the "bad" board states are generated by sampler (default: 1 random pseudo-legal move per position)
+        # (returns the index after the last written sample)
+
+        if sampler is None: sampler = NegativeSampler()
+
+        samples = [] # board, perspective and label of every sample of the game (in order)
+
+        # figure out who won the game
+        if winner == chess.WHITE:
+            # if white won, all even moves by index (move 0, move 2, move 4 etc.) are "good" moves
+
+            good_move_start = 0
+            offset = 1 if len(moves_played) % 2 != 0 else 0
+        else:
+            # if black won, all uneven moves by index (move 1, move 3, move 5 etc.) are "good" moves
+            # since loop over moves below starts at the index of the first "good" move,
+            # and black won this game, white's opener has to be labeled as a "bad" move
+
+            good_move_start = 1
+            offset = 0 if len(moves_played) % 2 != 0 else 1
+
+            samples.extend((bad_board, chess.WHITE, 0) for bad_board in sampler.sample(game_board, rng))
+
+            game_board.push(moves_played[0]) # play the 1st move since the loop starts at index 1 instead of 0
+
+        for move in range(good_move_start, len(moves_played) - offset, 2):
+            # label the board states correctly ("good"/"bad" move)
+            # for bad moves, make random moves from all possible moves of the current board state 
+            # (because all games are GrandMaster games and thus (early) moves are not necessarily bad)
+            bad_boards = sampler.sample(game_board, rng)
+
+            # play the next move of the game ("good" move)
+            game_board.push(moves_played[move])
+
+            samples.append((game_board.copy(stack=False), winner, 1)) # "good" moves get a 1
+            samples.extend((bad_board, winner, 0) for bad_board in bad_boards) # "bad" moves get a 0
+
+            # play the next move as well (for which we did a random move) so the board stays correct
+            game_board.push(moves_played[move+1]) 
         
+        if offset:
+            # edge case: loop above increments by 2 every iteration
+            # -> in some cases the last move will not be executed in the loop
+            # -> has to be "manually" executed outside of the loop
+
+            game_board.push(moves_played[-1])
+
+            # the last move of a checkmate game is always the winning move
+            samples.append((game_board.copy(stack=False), winner, 1))
+
+        # convert all board states of the game in one batch per perspective
+        convert_boards = encoder.pack_boards if packed else encoder.encode_boards
+
+        for color in (chess.WHITE, chess.BLACK):
+            indices = [k for k, (board, perspective, label) in enumerate(samples) if perspective == color]
+            if indices: X[i + np.array(indices)] = convert_boards([samples[k][0] for k in indices], color)
+
+        y[i:i+len(samples)] = [label for board, perspective, label in samples]
+
+        if keys is not None: keys[i:i+len(samples)] = [sample_key(board, perspective, label) for board, perspective, label in samples]
+
+        return i + len(samples)
+
+    @staticmethod
+    def read_games(pgn, games=None):
+        # read the next games (all or the given number) of an (opened) pgn file one at a time and yield the index
+        # of the game (counting all games read), the starting board, the winner and the moves of every "valid" game
+        # (only if game ended in checkmate and game was "valid" 
+        # ( -> min. 2 moves; sometimes PGN contains falsely formatted games))
+        # games without a winner are skipped right after reading their headers
+
+        for index in count() if games is None else range(games):
+            game = chess.pgn.read_game(pgn, Visitor=GameMoves) # read the next game
+            if game is None: break
+
+            board, winner, moves_played = game
+
+            if winner is not None and len(moves_played) >= 2: yield index, board, winner, moves_played
+
+    @staticmethod
+    def encode_chunk(task):
+        # read and encode a chunk of games of a pgn file (found by game_chunks)
+        # returns X, y, the keys (if dedup) of the samples and the index after the last sample of every encoded game
+        # (run by the workers in parse_pgns_parallel, a game that can't be read ends the chunk like it ends the file in parse_pgn)
+
+        pgn_file, offset, games, seed, packed, dedup, sampler = task
+        rng = np.random.RandomState(np.random.MT19937(seed))
+        samples = SampleBuffer(packed=packed, keys=dedup)
+        ends = []
+
+        try:
+            with open(pgn_file) as pgn:
+                pgn.seek(offset)
+
+                for _, board, winner, moves_played in PGNParser.read_games(pgn, games):
+                    samples.reserve(sampler.samples_per_game(winner, len(moves_played)))
+                    samples.size = PGNParser.encode_game(board, winner, moves_played, samples.X, samples.y, samples.size, rng, packed, samples.keys, sampler)
+                    ends.append(samples.size)
+
         except Exception as e:
-            print(f"Some game(s) from {pgn_file} could not be read!")
-            print("There seems to be something wrong with the PGN format of the file.")
-            print("Consider removing it from the data folder.")
-            print(e)
+            PGNParser.read_error(pgn_file, e)
+
+        X, y = samples.arrays()
+
+        return X, y, samples.keys[:samples.size] if dedup else None, ends
 
-        # only return games list if it contains at least 1 game (might not if self.max_size is already reached)
-        return games if games else None
-    
     @staticmethod
-    def convert_board_to_tensor(board, color):
-        # convert the current board state to a 8x8x6 tensor (1 8x8 board for every figure)
-        # the ANN is supposed to learn "good" white board positions
+    def read_error(pgn_file, error):
+        # report a pgn file that could not be read completely
 
-        board_state = np.zeros((8, 8, 6), dtype=np.int8)
-        
-        white_val = 1
+        print(f"Some game(s) from {pgn_file} could not be read!")
+        print("There seems to be something wrong with the PGN format of the file.")
+        print("Consider removing it from the data folder.")
+        print(error)
 
-        if color == chess.BLACK:
-            # if black won the game, flip the board
-            # so the "good" board positions look like as if white played the move
-            board = board.transform(chess.flip_vertical)
-            white_val = -1
+    def parse_pgn(self, pgn_file, samples, prefix="", file_index=0):
+        # read a pgn file containing multiple games one game at a time,
+        # find the winner of every game in order to assign a "goodness" value
+        # for every move and write the encoded board states into samples
+        # (file_index: index of the file in the data folder, part of the seeds of its chunks)
 
-        piece_map = board.piece_map() # get position of every figure (after potential flip)
+        print(f"{prefix} Reading games from PGN file '{pgn_file}'...")
+        gc = 0
+        dropped = 0 # duplicate samples
 
-        black_val = -white_val
+        try:
+            with open(pgn_file) as pgn:
+                chunk = None
 
-        layer_indices = {"k" : 0, "p" : 1, "r" : 2, "b" : 3, "n" : 4, "q" : 5}
+                for index, board, winner, moves_played in self.read_games(pgn):
+                    if samples.size >= self.max_size: break
 
-        layer_indices2 = {"k" : 0, "p" : 1, "r" : 2, "b" : 3, "n" : 4, "q" : 5,
-                         "K" : 6, "P" : 7, "R" : 8, "B" : 9, "N" : 10, "Q" : 11}
+                    # first game of a chunk (like in parse_pgns_parallel): new rng
+                    if index // self.chunk_size != chunk:
+                        chunk = index // self.chunk_size
+                        rng = np.random.RandomState(np.random.MT19937(self.chunk_seed(file_index, chunk)))
 
-        values = {"p" : 1, "n" : 3, "b" : 3, "r" : 5, "q" : 9, "k" : 10}
+                    gc += 1
+                    if gc % 10 == 0: print(f"{prefix} Parsing game {gc} resulting in checkmate ({samples.size} board state samples generated)\n")
 
-        for pos in piece_map:
-            curr_piece = piece_map[pos].symbol()
+                    start = samples.size
 
-            # calculate the correct index for the current tensor value
-            row = np.abs(pos // 8 - 7)
-            col = pos % 8
-            layer = layer_indices[curr_piece.lower()]
+                    samples.reserve(self.sampler.samples_per_game(winner, len(moves_played)))
+                    samples.size = self.encode_game(board, winner, moves_played, samples.X, samples.y, samples.size, rng, self.packed, samples.keys, self.sampler)
 
-            # pieces of winning color get 1, pieces of losing color get -1
-            board_state[row, col, layer] = white_val if curr_piece.isupper() else black_val
+                    if self.dedup: dropped += samples.drop_duplicates(start, self.positions)
         
-        return board_state
+        except Exception as e:
+            self.read_error(pgn_file, e)
+
+        print(f"{prefix} Finished! Parsed {gc} games resulting in checkmate ({samples.size} board state samples generated)\n")
+
+        if self.dedup:
+            self.duplicates[pgn_file] = dropped
+            print(f"{prefix} Dropped {dropped} duplicate board states\n")
+    
+    @staticmethod
+    def convert_board_to_tensor(board, color):
+        # convert the current board state to a 8x8x6 tensor (1 8x8 board for every figure)
+        # the ANN is supposed to learn "good" white board positions
+        # (if black won the game, the board is flipped so the "good" board positions
+        # look like as if white played the move; pieces of the winning color get 1,
+        # pieces of the losing color get -1)
+
+        return encoder.encode_board(board, color)
+
+    @staticmethod
+    def convert_board(board, color, packed=False):
+        # convert the current board state to a 8x8x6 tensor or (if packed) to 12 bit-packed bitboards
+
+        return encoder.pack_board(board, color) if packed else encoder.encode_board(board, color)
+
+    @staticmethod
+    def empty_samples(size, packed=False):
+        # allocate the arrays for size board states (X) and their labels (y)
+
+        X = np.empty((size, 12), dtype="<u8") if packed else np.empty((size, 8, 8, 6), dtype=np.int8)
+
+        return X, np.empty(size, dtype=np.uint8)
 
-    def save_training_data(self, X, y):
-        # save the training data to a .npz file
-        # so it doesn't have to be recalculated every time
+    def save_training_data(self, X, y, sharded=False, shard_size=100000):
+        # save the training data to a .npz file (or a directory of uncompressed .npy shards
+        # that can be memory-mapped, see dataset.py) so it doesn't have to be recalculated every time
 
-        np.savez_compressed(f"{self.data_path}training_data_{self.max_size}", X=X, y=y)
+        if sharded:
+            writer = ShardWriter(f"{self.data_path}training_data_{self.max_size}", shard_size, self.packed)
+            writer.write(X, y)
+            writer.close()
+        else:
+            np.savez_compressed(f"{self.data_path}training_data_{self.max_size}", X=X, y=y)
 
 if __name__ == "__main__": 
-    pgn_parser = PGNParser(max_size=10000)
-    pgn_parser.save_training_data(pgn_parser.X, pgn_parser.y)
\ No newline at end of file
+    pgn_parser = PGNParser(max_size=10000, workers=os.cpu_count(), seed=0, packed=True)
+    pgn_parser.save_training_data(pgn_parser.X, pgn_parser.y, sharded=True)
\ No newline at end of file
@@ -1,12 +1,12 @@
 #!/usr/bin/env python3
 
-import chess, chess.svg, flask, sunfish, argparse
+import chess, chess.svg, flask, sunfish, argparse, registry, book, zobrist
 import numpy as np
 from pathlib import Path
-from tensorflow import keras
 from time import sleep
-from pgnparser import PGNParser
-from model import Model
+from threading import Thread
+from evaluator import Evaluator
+from search import Searcher
 from sys import argv
 
 game = None
@@ -20,6 +20,21 @@ app = flask.Flask(__name__)
 class Game:
 
     depth = 0
+    movetime = None # time budget of a move (in s), the search is deepened iteratively until it runs out
+    max_nodes = None # node budget of a move (like movetime)
+    workers = 1 # number of processes searching the root moves in parallel
+    prefilter = None # hybrid evaluation: only the best N children of a position by material + piece-square tables (and captures) are evaluated by the model
+    ponder = False # search the expected reply of the player while they think (see start_pondering)
+    pruning = () # selective search features: "null" (null move pruning), "lmr" (late move reductions), "futility" (see Searcher)
+    quiescence = True # resolve captures at the leaves of the search before evaluating them (see Searcher.quiescence_search)
+    engine = "keras" # inference backend ("keras" or "numpy": forward pass in numpy, no tensorflow needed)
+    batch_leaves = False # evaluate the last 2 plies of the search tree in 1 model call per node (see Searcher.frontier_scores)
+    book = None # opening book (memory-mapped reader, see book.py), its moves are played without evaluating the position
+    quantized = None # "int8" or "float16": use the quantized version of the model (see Model.export_quantized)
+
+    shared_inference = False # all games evaluate their boards with 1 InferenceService per model (used by the web app)
+    max_latency = 0.002 # max time (in s) an inference request waits to be batched with others (only if other requests are pending)
+    max_batch_size = 1024 # max number of boards per batch of an inference service
 
     def __init__(self, model, bot_move_delay=0):
         # load a model stored in model/, create an empty board to play on
@@ -31,120 +46,118 @@ class Game:
         self.update_move_history(None, None, None) # reset the move history before the start of a new game
         self.update_svg_board(None) # initialize/update the svg game board as empty
         self.model = self.initialize_model(self.model_path + model)
+        self.searcher = None # Searcher of the last/current move
+        self.searchers = {} # model (Evaluator) -> its last Searcher (the next one reuses its tables)
+
+        # pondering: background search of the position after the expected reply of the player
+        self.ponder_thread = None
+        self.ponder_searcher = None
+        self.ponder_key = None # zobrist hash of the position it searches
+        self.ponder_result = None # its best move
+        self.ponder_hits = self.ponder_misses = 0
 
     def initialize_model(self, model_path):
-        # load a previously trained model
+        # get a previously trained model from the model registry (only loaded by the first game that uses it)
+        # (wrapped in an Evaluator, which caches the model outputs for the lifetime of the game)
+
+        backend = Game.quantized or Game.engine
+
+        # shared inference: all games send their boards to the same inference service
+        if Game.shared_inference: return Evaluator(registry.get_service(model_path, backend, Game.max_batch_size, Game.max_latency), source=(model_path, backend), prefilter=Game.prefilter)
 
-        return keras.models.load_model(model_path)
+        return Evaluator(registry.get(model_path, backend), source=(model_path, backend), prefilter=Game.prefilter)
 
     @staticmethod
     def update_svg_board(board):
         with open(path.joinpath("src/static/board.svg"), "w") as fout: fout.write(chess.svg.board(board))
     
-    @staticmethod
-    def evaluate_board_state(board, model, color):
-        # calculate model output for a board state/position
-
-        board_state = PGNParser.convert_board_to_tensor(board, color)
-        board_state = board_state.reshape((1,) + board_state.shape)
-        return model.predict(board_state, verbose=0)
+    def predict_best_move(self, board, model, color):
+        # predict the best move from all possible moves
+        # based on the current board state (see Searcher)
+        # (positions of the opening book are looked up instead)
 
-    @staticmethod
-    def alpha_beta(depth, board, model, color, alpha, beta, maximizing_player, n=5):
-        # alpha beta pruning algorithm (determines best move to play)
+        # pondering is always stopped first (its search shares the model/Evaluator)
+        # the player played the expected move: use the result of pondering
+        if self.ponder_thread is not None:
+            move = self.stop_pondering(board)
+            if move is not None: return move
 
-        if depth == 0: return Game.evaluate_board_state(board, model, color)
-        
-        moves_to_check = Game.calc_move_scores(board, model, color, n) # only pick best n moves to further evaluate (to save time)
+        if Game.book is not None:
+            move = book.book_move(Game.book, board)
+            if move is not None: return move
 
-        if maximizing_player:
-            val = np.NINF
+        # parallel search: the root moves are searched by a pool of processes (each with its own copy of the model)
+        pool = registry.get_pool(*model.source, Game.workers) if Game.workers > 1 else None
 
-            for move in moves_to_check:
-                board.push(move)
-                val = max(val, Game.alpha_beta(depth-1, board, model, color, alpha, beta, False))
-                board.pop()
+        # the tables of the previous search of the model in this game (transposition table, history) are reused
+        self.searcher = Searcher(model, Game.depth, Game.movetime, Game.max_nodes, Game.batch_leaves, pool, Game.quiescence, Game.pruning, self.searchers.get(model))
+        self.searchers[model] = self.searcher
 
-                alpha = max(alpha, val)
+        return self.searcher.predict_best_move(board, color)
 
-                if val >= beta: break
-            
-            return val
-        
-        else:
-            val = np.Inf
+    def expected_reply(self, board, model):
+        # the move the player is expected to play: the best move of the position in the transposition table
+        # of the last search (with parallel search the best replies found by the workers), else the one with the best model output
 
-            for move in moves_to_check:
-                board.push(move)
-                val = min(val, Game.alpha_beta(depth-1, board, model, color, alpha, beta, True))
-                board.pop()
+        if self.searcher is not None:
+            entry = self.searcher.tt.probe(zobrist.board_key(board))
+            if entry and entry[3] and board.is_legal(entry[3]): return entry[3]
 
-                beta = min(beta, val)
+        return Searcher(model, quiescence=Game.quiescence, pruning=Game.pruning).predict_best_move(board, board.turn)
 
-                if val <= alpha: break
+    def start_pondering(self, board, model, color):
+        # search the position after the expected reply of the player in a background thread
+        # (until the player moves, see stop_pondering; color: color of the bot)
+        # a search that is still pondering is aborted first (only 1 search may use the model at a time)
 
-            return val
+        self.stop_pondering()
 
-    @staticmethod
-    def calc_move_scores(board, model, color, n=1):
-        # calculate the scores of all possible moves
-        # and return the best n moves (sorted by score)
+        if board.is_game_over(): return
 
-        legal_moves = np.array(tuple(board.legal_moves))
+        ponder_board = board.copy()
+        ponder_board.push(self.expected_reply(board, model))
 
-        if legal_moves.size == 0:
-            # if no moves that don't put the king in check are possible,
-            # play one of those (means that the game is over)
+        if ponder_board.is_game_over() or (Game.book is not None and book.book_move(Game.book, ponder_board) is not None): return
 
-            pseudo_legal_moves = board.pseudo_legal_moves
-            legal_moves_uci = {move.uci() for move in legal_moves}
-            pseudo_legal_moves_uci = {move.uci() for move in pseudo_legal_moves}
-            legal_moves = np.array([chess.Move.from_uci(move) for move in legal_moves_uci ^ pseudo_legal_moves_uci])
+        pool = registry.get_pool(*model.source, Game.workers) if Game.workers > 1 else None
 
-        possible_boards = np.empty((len(legal_moves), 8, 8, 6))
+        searcher = Searcher(model, Game.depth, Game.movetime, Game.max_nodes, Game.batch_leaves, pool, Game.quiescence, Game.pruning, self.searchers.get(model))
 
-        for i, move in enumerate(legal_moves):
-            board.push(move)
-            possible_boards[i] = PGNParser.convert_board_to_tensor(board, color)
-            board.pop()
-        
+        self.ponder_searcher = searcher
+        self.ponder_key = zobrist.board_key(ponder_board)
+        self.ponder_result = None
 
-        # find the move that resulted in the biggest output value
-        # and assume, that that move is the best one
-        vals_of_moves = model.predict(possible_boards, verbose=0).flatten()
-        best_moves_i = np.argsort(vals_of_moves) # sort scores by index ascending
+        def ponder():
+            self.ponder_result = searcher.predict_best_move(ponder_board, color, ponder=True)
 
-        best_n_moves = legal_moves[best_moves_i[best_moves_i.size - n:]]
+        self.ponder_thread = Thread(target=ponder, daemon=True)
+        self.ponder_thread.start()
 
-        return best_n_moves
+    def stop_pondering(self, board=None):
+        # stop pondering after the player moved (board: position after the move)
+        # ponder hit (the expected position): the search gets its time budget, is finished and its best move returned
+        # miss: the search is aborted, returns None
 
-    @staticmethod
-    def predict_best_move(board, model, color):
-        # predict the best move from all possible moves
-        # based on the current board state
-        # using additional alpha-beta-pruning if depth is bigger 0
+        searcher, thread = self.ponder_searcher, self.ponder_thread
+        self.ponder_searcher = self.ponder_thread = None
 
-        best_5_moves = Game.calc_move_scores(board, model, color, n=5) # calculate 5 best moves based on model output
-        best_move = best_5_moves[-1]
+        if thread is None: return None
 
-        if Game.depth > 0:
-            # if user entered depth bigger than 0,
-            # run additional alpha-beta-pruning to
-            # search the game tree for a better move
-            # until the max depth is reached
+        if board is not None and zobrist.board_key(board) == self.ponder_key:
+            searcher.ponder_hit()
+            thread.join()
 
-            best_move_val = np.NINF
+            self.ponder_hits += 1
+            self.searcher = self.searchers[searcher.model] = searcher
 
-            # only search the game tree starting with the 5 best moves
-            for curr_move in best_5_moves:
+            return self.ponder_result
 
-                board.push(curr_move)
-                curr_move_val = Game.alpha_beta(Game.depth, board, model, color, np.NINF, np.Inf, True)
-                board.pop()
+        searcher.abort()
+        thread.join()
 
-                if curr_move_val > best_move_val: best_move = curr_move
+        if board is not None: self.ponder_misses += 1
 
-        return best_move
+        return None
 
     @staticmethod
     def execute_move(move, board, move_c, quiet=True):
@@ -175,6 +188,11 @@ class Game:
         # play a random move
         # (needed e.g. for the bot playing against itself
         # so it doesn't play the same game every time)
+        # (positions of the opening book get a random move of the book instead)
+
+        if Game.book is not None:
+            move = book.book_move(Game.book, board)
+            if move is not None: return move
 
         possible_moves = tuple(board.pseudo_legal_moves)
         return possible_moves[np.random.randint(0, len(possible_moves))]
@@ -253,7 +271,12 @@ class Game:
 
             self.move_c = self.execute_move(bot_move, self.board, self.move_c,quiet=quiet)
 
+            # think about the next move while the player thinks
+            if Game.ponder: self.start_pondering(self.board, self.model, chess.BLACK)
+
         print(self.get_game_result(self.board))
+        print(self.model)
+        if Game.ponder: print(f"Pondering: {self.ponder_hits} hits, {self.ponder_misses} misses")
 
         return
 
@@ -281,6 +304,7 @@ class Game:
             self.move_c = self.execute_move(bot_move, self.board, self.move_c, quiet=quiet)
         
         print(self.get_game_result(self.board))
+        print(self.model)
 
         return
     
@@ -316,6 +340,8 @@ class Game:
             self.move_c = self.execute_move(bot_move, self.board, self.move_c, quiet=quiet)
         
         print(self.get_game_result(self.board))
+        print(main_model)
+        print(opp_model)
 
         return
     
@@ -356,6 +382,7 @@ class Game:
             self.move_c = self.execute_move(chess.Move.from_uci(sunfish_move_uci), self.board, self.move_c, quiet=quiet) # play sunfish's move on main board
         
         print(self.get_game_result(self.board))
+        print(self.model)
         
         return
 
@@ -383,6 +410,8 @@ def run_game():
         Game.update_svg_board(game.board)
 
     elif flask.request.form.get("reset"):
+        if game: game.stop_pondering()
+
         move_history = ""
         game = None
         Game.update_svg_board(None)
@@ -411,7 +440,7 @@ def run_game():
 
         if game.board.is_game_over() or game.board.is_fifty_moves():  return Game.get_game_result(game.board)
 
-        bot_move = Game.predict_best_move(game.board, game.model, chess.BLACK)
+        bot_move = game.predict_best_move(game.board, game.model, chess.BLACK)
 
         sleep(1)
         print(f"[BLACK] Pychessbot's move: '{bot_move.uci()}'\n")
@@ -420,6 +449,9 @@ def run_game():
         move_history += f'[{"WHITE" if game.board.turn == chess.WHITE else "BLACK"}] {move.uci()}' + '<br>'
 
         if game.board.is_game_over() or game.board.is_fifty_moves(): return Game.get_game_result(game.board)
+
+        # think about the next move while the player thinks
+        if Game.ponder: game.start_pondering(game.board, game.model, chess.BLACK)
         
         return move_history
     
@@ -443,13 +475,43 @@ if __name__ == "__main__":
         parser.add_argument("--self", "-s", action="store_true", help="Let PyChessBot play a game against itself")
         parser.add_argument("--sunfish", "-sf", action="store_true", help="Let PyChessBot play a game against the Sunfish engine")
         parser.add_argument("--model", "-m", nargs=2, metavar=("model1", "model2"), type=str, help="Let two models from pychessbot/model/ play against each other")
-        parser.add_argument("--depth", "-d", metavar="N", type=int, help="search depth for best move prediction")
+        parser.add_argument("--depth", "-d", metavar="N", type=int, help="search depth for best move prediction (max depth with --movetime/--nodes)")
+        parser.add_argument("--movetime", "-t", metavar="MS", type=float, help="time per move: the search is deepened iteratively until the time is up")
+        parser.add_argument("--nodes", metavar="N", type=int, help="number of searched nodes per move (like --movetime)")
+        parser.add_argument("--ponder", action="store_true", help="search the expected reply of the player while they think (player games)")
+        parser.add_argument("--book", action="store_true", help="play the moves of the opening book built from data/*.pgn (see book.py) while the position is in it")
+        parser.add_argument("--prefilter", metavar="K", type=int, help="hybrid evaluation: only the K best moves of a position by material + piece-square tables (and all captures) are evaluated by the model")
+        parser.add_argument("--no-quiescence", action="store_true", help="evaluate the leaves of the search without resolving captures first")
+        parser.add_argument("--prune", nargs="+", choices=("null", "lmr", "futility"), default=(), help="selective search: null move pruning, late move reductions, futility pruning")
+        parser.add_argument("--workers", "-w", metavar="N", type=int, default=1, help="number of processes that search the root moves in parallel")
+        parser.add_argument("--engine", "-e", choices=("keras", "numpy"), default="keras", help="inference backend for the model (numpy: no tensorflow needed)")
+        parser.add_argument("--quantized", "-q", choices=("int8", "float16"), help="use the quantized version of the model (tflite, see model.py --quantize)")
+        parser.add_argument("--batch", "-b", action="store_true", help="evaluate the positions of the search tree in batches (faster for depth > 0)")
+        parser.add_argument("--max-latency", metavar="MS", type=float, default=2, help="max time an inference request of the web app waits to be batched with the requests of other games (only if other requests are pending)")
 
         args = parser.parse_args()
 
         if args.depth: Game.depth = args.depth
-
-        if total_game_mode_args == 0: app.run(host="0.0.0.0", port=5000)
+        if args.movetime: Game.movetime = args.movetime / 1000
+        Game.max_nodes = args.nodes
+        Game.workers = args.workers
+        Game.prefilter = args.prefilter
+        Game.ponder = args.ponder
+        if args.book: Game.book = book.open_book()
+        Game.quiescence = not args.no_quiescence
+        Game.pruning = args.prune
+        Game.engine = args.engine
+        Game.quantized = args.quantized
+        Game.batch_leaves = args.batch
+        Game.max_latency = args.max_latency / 1000
+
+        if total_game_mode_args == 0:
+            # all games of the web app share 1 loaded model
+            # (loaded and warmed up before the server starts, so no game has to wait for it)
+            Game.shared_inference = True
+            registry.get_service(path.joinpath("model/chess_model_v2").as_posix(), Game.quantized or Game.engine, Game.max_batch_size, Game.max_latency)
+
+            app.run(host="0.0.0.0", port=5000)
 
         else:
             game = Game("chess_model_v2")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import chess
+import sunfish
+
+# material + piece-square-table evaluation with the tables of sunfish (sunfish.pst, values include the piece values)
+# sunfish's board is a 10x12 array (a1 = 91, h8 = 28) seen from the player at turn,
+# the pieces of the other player are looked up at the rotated square (119 - index)
+
+PIECE_SYMBOLS = " PNBRQK" # index: piece type
+SUNFISH_SQUARES = [sunfish.A1 - 10 * chess.square_rank(sq) + chess.square_file(sq) for sq in chess.SQUARES]
+
+# color, piece type, square -> value of the piece for its color (nested lists: fast to index with python ints)
+TABLES = [[[0] * 64 for _ in range(7)] for _ in chess.COLORS]
+
+for piece_type in chess.PIECE_TYPES:
+    for sq, i in zip(chess.SQUARES, SUNFISH_SQUARES):
+        TABLES[chess.WHITE][piece_type][sq] = sunfish.pst[PIECE_SYMBOLS[piece_type]][i]
+        TABLES[chess.BLACK][piece_type][sq] = sunfish.pst[PIECE_SYMBOLS[piece_type]][119 - i]
+
+PIECE_VALUES = [0] + [sunfish.piece[symbol] for symbol in PIECE_SYMBOLS[1:]] # index: piece type
+
+
+def evaluate(board):
+    # score of a board for the player at turn (own pieces - opponent's pieces)
+
+    score = 0
+
+    for color in chess.COLORS:
+        sign = 1 if color == board.turn else -1
+        tables = TABLES[color]
+
+        for piece_type in chess.PIECE_TYPES:
+            table = tables[piece_type]
+            for sq in chess.scan_forward(board.pieces_mask(piece_type, color)): score += sign * table[sq]
+
+    return score
+
+
+def move_delta(board, move):
+    # change of the score of the player at turn caused by a move
+    # (moved, captured, promoted and castled pieces, like sunfish.Position.value)
+
+    from_sq, to_sq = move.from_square, move.to_square
+    piece_type = board.piece_type_at(from_sq)
+    turn = board.turn
+    own, other = TABLES[turn], TABLES[not turn]
+
+    if piece_type == chess.KING and board.is_castling(move):
+        rank = chess.square_rank(from_sq)
+        kingside = board.is_kingside_castling(move)
+        rook_from = to_sq if board.rooks & board.occupied_co[turn] & chess.BB_SQUARES[to_sq] else chess.square(7 if kingside else 0, rank)
+        king_to = chess.square(6 if kingside else 2, rank)
+
+        return own[chess.KING][king_to] - own[chess.KING][from_sq] + own[chess.ROOK][chess.square(5 if kingside else 3, rank)] - own[chess.ROOK][rook_from]
+
+    delta = own[move.promotion or piece_type][to_sq] - own[piece_type][from_sq]
+
+    if piece_type == chess.PAWN and board.is_en_passant(move):
+        delta += other[chess.PAWN][chess.square(chess.square_file(to_sq), chess.square_rank(from_sq))]
+    else:
+        captured = board.piece_type_at(to_sq)
+        if captured: delta += other[captured][to_sq]
+
+    return delta
+
+
+def tactical_moves(board):
+    # legal captures and promotions
+
+    yield from board.generate_legal_captures()
+
+    # promotions without capture (only if there are pawns on the 7th rank)
+    pawns = board.pawns & board.occupied_co[board.turn] & (chess.BB_RANK_7 if board.turn == chess.WHITE else chess.BB_RANK_2)
+    if pawns: yield from board.generate_legal_moves(pawns, chess.BB_BACKRANKS & ~board.occupied)
+
+
+def losing_capture(board, move):
+    # does a capture obviously lose material (captured piece is defended and worth less than the capturing one)?
+
+    victim = board.piece_type_at(move.to_square)
+    if not victim or move.promotion: return False
+
+    return PIECE_VALUES[board.piece_type_at(move.from_square)] > PIECE_VALUES[victim] and board.is_attacked_by(not board.turn, move.to_square)
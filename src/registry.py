@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import numpy as np
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from inference import InferenceService
+
+# process-wide registry of loaded models: every model (path + backend) is loaded and warmed up only once,
+# all games get the same handle
+# backends: "keras", "numpy" (see NumpyModel), "int8"/"float16" (quantized, see TFLiteModel)
+
+models = {} # (model path, backend) -> model
+services = {} # (model path, backend) -> InferenceService of the model
+pools = {} # (model path, backend, workers) -> (process pool for parallel root search, stop event of its workers)
+load_times = {} # (model path, backend) -> time (in s) it took to load and warm up the model
+
+lock = Lock()
+
+
+def load(model_path, backend="keras"):
+    # load a model with an inference backend
+    # (tensorflow is only imported if the backend needs it)
+
+    if backend in ("int8", "float16"):
+        from tflite_model import TFLiteModel
+
+        model_file = Path(model_path).joinpath(f"{backend}.tflite")
+        if not model_file.is_file(): raise FileNotFoundError(f"'{model_file}' doesn't exist (export it with: ./model.py --quantize {Path(model_path).name})")
+
+        return TFLiteModel(model_file)
+
+    if backend == "numpy":
+        from numpy_model import NumpyModel
+
+        return NumpyModel(model_path)
+
+    from tensorflow import keras
+
+    return keras.models.load_model(model_path)
+
+
+def warm_up(model, batch_sizes=(1, 32)):
+    # run the model on dummy batches, so the first real prediction doesn't pay for
+    # graph tracing, memory allocation etc.
+
+    for batch_size in batch_sizes: model.predict(np.zeros((batch_size, 8, 8, 6), dtype=np.float32), verbose=0)
+
+
+def get(model_path, backend="keras"):
+    # shared handle of a model (loaded on first use)
+
+    key = (str(model_path), backend)
+
+    with lock:
+        if key not in models:
+            start = perf_counter()
+
+            model = load(model_path, backend)
+            warm_up(model)
+
+            models[key] = model
+            load_times[key] = perf_counter() - start
+
+    return models[key]
+
+
+def get_service(model_path, backend="keras", max_batch_size=1024, max_latency=0.002):
+    # shared inference service of a model (see InferenceService)
+
+    key = (str(model_path), backend)
+    model = get(model_path, backend)
+
+    with lock:
+        if key not in services: services[key] = InferenceService(model, max_batch_size, max_latency)
+
+    return services[key]
+
+
+def get_pool(model_path, backend="keras", workers=2):
+    # shared process pool for the parallel root search (see Searcher.search_root_parallel)
+    # (spawned processes, every worker loads the model itself)
+
+    from search import Searcher
+
+    key = (str(model_path), backend, workers)
+
+    with lock:
+        if key not in pools:
+            context = multiprocessing.get_context("spawn")
+            stop = context.Event()
+
+            pools[key] = (context.Pool(workers, Searcher.init_worker, (str(model_path), backend, stop)), stop)
+
+    return pools[key]
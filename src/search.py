@@ -0,0 +1,725 @@
+#!/usr/bin/env python3
+
+import chess
+import numpy as np
+import zobrist
+import registry
+import pst
+from evaluator import Evaluator
+from itertools import count
+from threading import Event
+from time import perf_counter, process_time, time
+
+MATE_VALUE = 100.0 # score of a checkmate (model outputs are in [-1, 1])
+PIECE_VALUES = (0, 1, 3, 3, 5, 9, 100) # index: piece type (for MVV-LVA move ordering)
+
+
+class SearchAborted(Exception):
+    # raised inside the search when the budget of a Searcher ran out or it was aborted
+    pass
+
+
+class TranspositionTable:
+    # fixed-size table of search results keyed by zobrist hash (numpy arrays, 1 entry per slot)
+    # the table can be reused by the searches of several moves of a game (see new_search): a new entry replaces
+    # the old one unless the old one was searched deeper and is of the same position or of the current search
+    # (entries of older searches are replaced first)
+    # mate scores are stored relative to the position (not to the root), so they stay valid for later searches
+
+    EXACT, LOWER, UPPER = 0, 1, 2 # kinds of values (exact score, lower bound after a beta cutoff, upper bound)
+
+    def __init__(self, size=1 << 18):
+        self.mask = size - 1 # size is a power of 2
+        self.keys = np.zeros(size, dtype=np.uint64)
+        self.values = np.zeros(size, dtype=np.float32)
+        self.depths = np.zeros(size, dtype=np.int8)
+        self.flags = np.zeros(size, dtype=np.int8)
+        self.moves = np.zeros(size, dtype=np.int32) # best move (see encode_move), 0 if none
+        self.ages = np.zeros(size, dtype=np.uint8) # search (generation) the entry was stored by
+
+        self.generation = 0
+        self.hits = self.misses = self.cutoffs = 0
+
+    def __str__(self):
+        return (f"Transposition table: {self.hits} hits, {self.misses} misses ({100 * self.hits / max(self.hits + self.misses, 1):.1f}% hit rate), "
+                f"{self.cutoffs} cutoffs, search {self.generation}")
+
+    def new_search(self):
+        # start the search of a new move (the entries of the previous searches get older, the stats are reset)
+
+        self.generation = (self.generation + 1) % 256
+        self.hits = self.misses = self.cutoffs = 0
+
+    @staticmethod
+    def encode_move(move):
+        return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12 if move else 0
+
+    @staticmethod
+    def decode_move(code):
+        return chess.Move(code & 63, code >> 6 & 63, code >> 12 or None) if code else None
+
+    @staticmethod
+    def mate_shift(value, plies):
+        # shift a mate score by a number of plies (non-mate scores stay the same)
+
+        return value + plies if value > MATE_VALUE / 2 else value - plies if value < -MATE_VALUE / 2 else value
+
+    def store_move(self, key, move):
+        # store only the best move of a position (no value, never used for a cutoff), unless the slot holds a searched
+        # entry of the position or of the current search (move-only entries are replaced)
+
+        i = key & self.mask
+
+        if self.depths[i] >= 0 and (self.keys[i] == key or (self.keys[i] != 0 and self.ages[i] == self.generation)): return
+
+        self.keys[i], self.depths[i], self.flags[i], self.moves[i] = key, -1, self.EXACT, self.encode_move(move)
+        self.values[i], self.ages[i] = 0.0, self.generation
+
+    def probe(self, key, ply=0):
+        # returns (depth, flag, value, best move) of a position (at ply of the search), or None if it isn't in the table
+
+        i = key & self.mask
+
+        if self.keys[i] != key:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return int(self.depths[i]), int(self.flags[i]), self.mate_shift(float(self.values[i]), -ply), self.decode_move(int(self.moves[i]))
+
+    def store(self, key, depth, flag, value, move, ply=0):
+        i = key & self.mask
+
+        if self.depths[i] > depth and (self.keys[i] == key or self.ages[i] == self.generation): return
+
+        self.keys[i], self.depths[i], self.flags[i], self.moves[i] = key, depth, flag, self.encode_move(move)
+        self.values[i], self.ages[i] = self.mate_shift(value, ply), self.generation
+
+
+class Searcher:
+    # predicts the best move of a position with a model (Evaluator):
+    # negamax alpha beta search (the model output of a position from the perspective of color is its score for color,
+    # the negated output its score for the opponent), moves ordered by transposition table/principal variation move,
+    # captures (MVV-LVA), killer moves and history heuristic, transposition table cutoffs
+    # the model is only called on the nodes before the leaves, for all of their children at once
+    # depth: number of plies searched after the move (0: play the move with the best model output)
+    # movetime/max_nodes: budget of a move (in s/number of searched nodes), if one of them is set,
+    # the search is deepened iteratively (depth 1, 2, ... up to depth, unlimited if depth is 0)
+    # until the budget runs out, the move of the last completed depth is played
+    # batch_leaves: evaluate the last 2 plies of the search tree in 1 model call per node (without pruning)
+    # pool: (process pool, stop event) of registry.get_pool, searches the root moves in parallel
+    # quiescence: leaves in the middle of a capture sequence are resolved by a capture search with a cheap
+    # material + piece-square-table score (see quiescence), the model evaluates the quiet position at its end
+    # pruning: selective search features, any of "null" (null move pruning), "lmr" (late move reductions),
+    # "futility" (futility pruning 2 plies before the leaves), the model output of a node is its static score
+    # previous: Searcher of the previous move of the game, its transposition table and history scores are reused
+    # (the history scores are halved, the entries of its transposition table are replaced first)
+
+    max_iterative_depth = 64 # depth limit of iterative deepening without a max depth
+    draw_value = 0.5 # model output of a drawn position (between the labels of bad (0) and good (1) moves)
+    quiescence_depth = 4 # max number of captures/promotions played by the quiescence search
+    delta_margin = 200 # quiescence search: captures that can't raise alpha by at least this much (pawn = 100) are skipped
+    null_move_reduction = 2 # null move pruning: the position after a null move is searched this much less deep
+    null_window = 1e-4 # width of the null windows of null move pruning and late move reductions
+    lmr_moves = 3 # late move reductions: number of moves of a node that are never reduced
+    lmr_reduction = 2 # late move reductions: plies a reduced move is searched less deep (even, see negamax)
+    futility_margin = 0.05 # futility pruning: max gain (in model output) of a quiet move 2 plies before the leaves
+
+    worker_model = None # Evaluator of a pool worker process (see init_worker)
+    worker_stop = None # stop event of the pool worker processes
+    worker_searcher = None # Searcher of the last task of a pool worker process (its tables are reused, see search_move)
+    search_ids = count() # ids of the parallel searches of a process (the workers reuse their tables within a search)
+
+    def __init__(self, model, depth=0, movetime=None, max_nodes=None, batch_leaves=False, pool=None, quiescence=True, pruning=(), previous=None):
+        self.model = model
+        self.depth = depth
+        self.movetime = movetime
+        self.max_nodes = max_nodes
+        self.batch_leaves = batch_leaves
+        self.pool = pool
+        self.quiescence = quiescence
+        self.pruning = set(pruning)
+
+        self.killers = [] # ply -> last 2 quiet moves that caused a beta cutoff
+
+        self.tt = TranspositionTable()
+        self.history = np.zeros((2, 64, 64), dtype=np.int64) # color, from square, to square -> history score
+        if previous is not None: self.reuse_tables(previous)
+
+        self.search_id = None # id of the parallel search (see search_root_parallel)
+        self.exact_depth_cutoffs = False # only cut off with tt entries of the same depth (see search_move)
+        self.task_moves = {} # root move -> best reply found by its last task (move ordering hint for the next iteration)
+        self.task_times = [] # cpu times of the tasks of the last parallel search, 1 list per batch of tasks (see benchmark.py)
+        self.color = chess.WHITE # perspective of the model outputs
+
+        self.stop = Event() # set by abort()
+        self.deadline = None
+        self.start = perf_counter() # start time of the last search
+        self.nodes = 0
+        self.qnodes = 0 # nodes of the quiescence search
+        self.resolved = 0 # leaves replaced by the quiet position at the end of their capture sequence
+        self.null_cutoffs = self.reductions = self.re_searches = self.futility_pruned = 0 # selective search stats
+        self.completed_depth = 0 # depth of the last completed iteration
+        self.best_value = 0.0 # score of the best move of the last completed iteration
+        self.elapsed = 0.0
+
+    def __str__(self):
+        return (f"depth {self.completed_depth}, score {self.best_value:.3f}, {self.nodes} nodes in {self.elapsed:.2f} s "
+                f"({self.nodes / max(self.elapsed, 1e-9):.0f} nodes/s), {self.qnodes} quiescence nodes, {self.resolved} leaves resolved\n"
+                f"{self.null_cutoffs} null move cutoffs, {self.reductions} late move reductions ({self.re_searches} re-searched), "
+                f"{self.futility_pruned} moves futility pruned\n{self.tt}")
+
+    def reuse_tables(self, previous, new_search=True):
+        # use the transposition table and the history scores of another Searcher
+        # new_search: the other Searcher searched a previous move (its tt entries get older, the history scores are halved),
+        # else it searched the same position (its killer moves are reused too)
+
+        self.tt = previous.tt
+
+        if new_search:
+            self.tt.new_search()
+            self.history = previous.history // 2
+        else:
+            self.history, self.killers = previous.history, previous.killers
+
+    def settings(self):
+        # everything the scores of the transposition table depend on
+
+        return self.color, self.quiescence, self.batch_leaves, self.model.prefilter, self.pruning
+
+    def merge_heuristics(self, history, killers):
+        # add the history scores and killer moves of another search of the same position (see search_root_parallel)
+
+        np.maximum(self.history, history, out=self.history)
+
+        for ply, ply_killers in enumerate(killers):
+            while len(self.killers) <= ply: self.killers.append([])
+            if not self.killers[ply]: self.killers[ply] = list(ply_killers)
+
+    def abort(self):
+        # stop the search as soon as possible (can be called from another thread)
+
+        self.stop.set()
+
+    def ponder_hit(self):
+        # the move a pondering search (see predict_best_move) expected was played: it gets its time budget
+        # (counted from the start of pondering, so it stops right away if it already pondered that long)
+        # (can be called from another thread)
+
+        if self.movetime is not None: self.deadline = self.start + self.movetime
+
+    def check_budget(self, nodes=1):
+        # count searched nodes, abort the search if the budget ran out
+
+        self.nodes += nodes
+
+        if self.stop.is_set() or (self.deadline is not None and perf_counter() > self.deadline) or (self.max_nodes is not None and self.nodes > self.max_nodes):
+            raise SearchAborted()
+
+    def score(self, value, turn):
+        # score of a model output (from the perspective of self.color) for the player at turn
+
+        return value if turn == self.color else -value
+
+    def move_scores(self, board, moves, values, ply):
+        # scores of moves for the player at turn (board at ply), given the model outputs of the resulting positions
+        # (moves that checkmate the opponent score MATE_VALUE - ply of the mate)
+
+        scores = values if board.turn == self.color else -values
+        ply += 1
+
+        for i, move in enumerate(moves):
+            if board.gives_check(move):
+                board.push(move)
+                if not any(board.generate_legal_moves()): scores[i] = MATE_VALUE - ply
+                board.pop()
+
+        return scores
+
+    def terminal_score(self, board, ply):
+        # score of a position without legal moves for the player at turn
+
+        return -(MATE_VALUE - ply) if board.is_check() else self.score(self.draw_value, board.turn)
+
+    def order_moves(self, board, moves, tt_move, ply):
+        # sort moves by how likely they are to be the best ones:
+        # transposition table move, captures/promotions (most valuable victim, least valuable attacker),
+        # killer moves, history score
+
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        history = self.history[int(board.turn)]
+
+        def priority(move):
+            if move == tt_move: return 1 << 40
+
+            victim = board.piece_type_at(move.to_square)
+
+            if victim or move.promotion:
+                return (1 << 30) + 16 * PIECE_VALUES[victim or 0] + PIECE_VALUES[move.promotion or 0] - PIECE_VALUES[board.piece_type_at(move.from_square)]
+
+            if move in killers: return (1 << 29) - killers.index(move)
+
+            return int(history[move.from_square, move.to_square])
+
+        return sorted(moves, key=priority, reverse=True)
+
+    def update_heuristics(self, board, move, depth, ply):
+        # remember a quiet move that caused a beta cutoff (killer move, history)
+
+        if board.is_capture(move) or move.promotion: return
+
+        while len(self.killers) <= ply: self.killers.append([])
+
+        killers = self.killers[ply]
+
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+
+        self.history[int(board.turn), move.from_square, move.to_square] += depth * depth
+
+    def negamax(self, board, key, depth, alpha, beta, ply):
+        # alpha beta search of board (zobrist hash key) to depth, returns its score for the player at turn
+
+        self.check_budget()
+
+        if ply > 0 and (board.is_repetition(2) or board.halfmove_clock >= 100): return self.score(self.draw_value, board.turn)
+
+        if depth == 0:
+            # leaf above the frontier (reached through a null move): evaluated at the end of its capture sequence too
+            end = self.resolve(board, pst.evaluate(board)) if self.quiescence else None
+            return self.score(self.model.evaluate(board if end is None else end, self.color), board.turn)
+
+        alpha_start = alpha
+        tt_move = None
+        entry = self.tt.probe(key, ply)
+
+        if entry:
+            tt_depth, flag, value, tt_move = entry
+
+            if tt_depth == depth or (tt_depth > depth and not self.exact_depth_cutoffs):
+                if flag == TranspositionTable.EXACT: return value
+                if flag == TranspositionTable.LOWER: alpha = max(alpha, value)
+                else: beta = min(beta, value)
+
+                if alpha >= beta:
+                    self.tt.cutoffs += 1
+                    return value
+
+        moves = list(board.legal_moves)
+
+        if not moves: return self.terminal_score(board, ply)
+
+        if depth == 1 or (depth == 2 and self.batch_leaves):
+            # nodes before the leaves: the children are evaluated in 1 model call
+            scores = self.frontier_scores(board, moves, depth, ply)
+            best_i = int(np.argmax(scores))
+            best, best_move = float(scores[best_i]), moves[best_i]
+
+            if best >= beta: self.update_heuristics(board, best_move, depth, ply)
+
+        else:
+            best, best_move = -np.inf, None
+            pieces_key = key ^ zobrist.state_key(board)
+            in_check = board.is_check()
+            static = None # model output of the position (score for the player at turn), only evaluated for pruning
+
+            if "null" in self.pruning and self.null_move_allowed(board, depth, beta, in_check):
+                static = self.static_score(board)
+
+                if static >= beta:
+                    # null move pruning: if passing still beats beta (searched less deep, with a null window), so does a move
+                    board.push(chess.Move.null())
+                    value = -self.negamax(board, pieces_key ^ zobrist.state_key(board), depth - 1 - self.null_move_reduction, -beta, -beta + self.null_window, ply + 1)
+                    board.pop()
+
+                    if value >= beta:
+                        self.null_cutoffs += 1
+                        return value
+
+            # futility pruning: the children of a node 2 plies before the leaves are only searched for quiet moves
+            # if the position isn't far below alpha
+            futile = False
+
+            if "futility" in self.pruning and depth == 2 and not in_check and -MATE_VALUE / 2 < alpha < MATE_VALUE / 2:
+                if static is None: static = self.static_score(board)
+                futile = static + self.futility_margin <= alpha
+
+            killers = self.killers[ply] if ply < len(self.killers) else ()
+            reduce = "lmr" in self.pruning and depth > self.lmr_reduction + 1 and not in_check
+
+            for i, move in enumerate(self.order_moves(board, moves, tt_move, ply)):
+                # quiet move (not the first one, not tactical, not a killer move): can be pruned/reduced
+                quiet = (futile or (reduce and i >= self.lmr_moves)) and i > 0 and not (move.promotion or board.is_capture(move) or move in killers or board.gives_check(move))
+
+                if futile and quiet:
+                    self.futility_pruned += 1
+                    if static > best: best = static # score of a pruned move (upper bound)
+                    continue
+
+                delta = zobrist.move_key(board, move)
+                child_key = pieces_key ^ delta
+
+                board.push(move)
+                child_key ^= zobrist.state_key(board)
+
+                if reduce and quiet and i >= self.lmr_moves:
+                    # late move reduction: quiet moves late in the move order are searched less deep (with a null window),
+                    # only if one beats alpha it's searched again to the full depth (null window first, the full window
+                    # only if it still beats alpha)
+                    # (by an even number of plies: the model outputs depend on the player who moved last, a search that ends
+                    # 1 ply earlier is biased and beat alpha so often that the re-searches cost more than the reductions saved)
+                    self.reductions += 1
+                    value = -self.negamax(board, child_key, depth - 1 - self.lmr_reduction, -alpha - self.null_window, -alpha, ply + 1)
+
+                    if value > alpha:
+                        self.re_searches += 1
+                        value = -self.negamax(board, child_key, depth - 1, -alpha - self.null_window, -alpha, ply + 1)
+
+                        if alpha < value < beta: value = -self.negamax(board, child_key, depth - 1, -beta, -alpha, ply + 1)
+
+                else:
+                    value = -self.negamax(board, child_key, depth - 1, -beta, -alpha, ply + 1)
+
+                board.pop()
+
+                if value > best: best, best_move = value, move
+                if value > alpha: alpha = value
+
+                if alpha >= beta:
+                    self.update_heuristics(board, move, depth, ply)
+                    break
+
+        flag = TranspositionTable.UPPER if best <= alpha_start else TranspositionTable.LOWER if best >= beta else TranspositionTable.EXACT
+        self.tt.store(key, depth, flag, best, best_move, ply)
+
+        return best
+
+    def null_move_allowed(self, board, depth, beta, in_check):
+        # can a node be pruned by a null move? not in check, not right after another null move, not when searching for mates,
+        # and only if the player at turn has pieces other than pawns (zugzwang is common in pawn endgames)
+
+        return (depth > self.null_move_reduction and not in_check and beta < MATE_VALUE / 2 and board.move_stack and board.move_stack[-1]
+                and board.occupied_co[board.turn] & ~(board.pawns | board.kings))
+
+    def static_score(self, board):
+        # model output of a position as its score for the player at turn (without search)
+
+        return self.score(self.model.evaluate(board, self.color), board.turn)
+
+    def frontier_scores(self, board, moves, depth, ply):
+        # scores of all moves of a node at depth 1 (model outputs of the children)
+        # or depth 2 (minimax of the model outputs of the grandchildren, all of them in 1 model call)
+
+        self.check_budget(len(moves))
+
+        if depth == 1: return self.move_scores(board, moves, self.leaf_values([(board, moves)])[0], ply)
+
+        children, children_moves, scores = [], [], np.empty(len(moves))
+
+        for i, move in enumerate(moves):
+            child = board.copy(stack=False)
+            child.push(move)
+            child_moves = list(child.legal_moves)
+
+            if child_moves:
+                children.append((i, child))
+                children_moves.append(child_moves)
+            else:
+                scores[i] = -self.terminal_score(child, ply + 1)
+
+        self.check_budget(sum(len(child_moves) for child_moves in children_moves))
+
+        values = self.leaf_values([(child, child_moves) for (_, child), child_moves in zip(children, children_moves)])
+
+        for (i, child), child_moves, child_values in zip(children, children_moves, values):
+            scores[i] = -np.max(self.move_scores(child, child_moves, child_values, ply + 1))
+
+        return scores
+
+    def quiescence_search(self, board, score, alpha, beta, depth=0):
+        # capture search with the material + piece-square-table score (pst.py) of the player at turn
+        # returns the score after the captures/promotions and the moves that lead to the quiet position it's reached in
+        # (a position in check isn't resolved and checking moves aren't played, so the line never ends in check)
+
+        self.qnodes += 1
+
+        best, line = score, () # stand pat: the player at turn doesn't have to capture
+        if best >= beta or depth == self.quiescence_depth or board.is_check(): return best, line
+        alpha = max(alpha, best)
+
+        # best gains first (MVV-LVA-like), without captures that lose material
+        # (a defended piece captured by a more valuable one)
+        moves = sorted(((pst.move_delta(board, move), move) for move in pst.tactical_moves(board) if not pst.losing_capture(board, move)), key=lambda x: x[0], reverse=True)
+
+        for delta, move in moves:
+            # delta pruning: the move can't raise the score above alpha (even without a recapture)
+            if score + delta + self.delta_margin <= alpha: break
+
+            if board.gives_check(move): continue
+
+            board.push(move)
+            value, move_line = self.quiescence_search(board, -(score + delta), -beta, -alpha, depth + 1)
+            board.pop()
+
+            if -value > best: best, line = -value, (move,) + move_line
+            alpha = max(alpha, best)
+
+            if alpha >= beta: break
+
+        return best, line
+
+    def resolve(self, board, score):
+        # quiet position at the end of the best capture sequence of board (full window quiescence search,
+        # score: pst score of board for the player at turn), None if standing pat is best
+
+        _, line = self.quiescence_search(board, score, -np.inf, np.inf)
+        if not line: return None
+
+        self.resolved += 1
+        end = board.copy(stack=False)
+        for move in line: end.push(move)
+
+        return end
+
+    def leaf_values(self, parents):
+        # model outputs (from the perspective of self.color) of the children of several boards
+        # parents: (board, moves) pairs, returns one array of outputs per pair
+        # with quiescence, children reached by a capture/promotion are evaluated at the quiet end of the capture sequence
+        # (the other children are evaluated together in 1 model call, see Evaluator.evaluate_children_batch)
+
+        if not self.quiescence: return self.model.evaluate_children_batch(parents, self.color)
+
+        quiet_parents, noisy, noisy_boards = [], [], [] # noisy: (parent index, move index) of the resolved children
+
+        for p, (board, moves) in enumerate(parents):
+            score = pst.evaluate(board)
+            quiet_moves = []
+
+            for i, move in enumerate(moves):
+                # only positions in the middle of a capture sequence are resolved
+                if not (move.promotion or board.is_capture(move)):
+                    quiet_moves.append(i)
+                    continue
+
+                child_score = -(score + pst.move_delta(board, move))
+
+                board.push(move)
+                end = self.resolve(board, child_score)
+                board.pop()
+
+                if end is not None:
+                    noisy.append((p, i))
+                    noisy_boards.append(end)
+                else:
+                    quiet_moves.append(i)
+
+            quiet_parents.append((board, quiet_moves))
+
+        quiet_values = self.model.evaluate_children_batch([(board, [moves[i] for i in quiet_moves]) for (board, quiet_moves), (_, moves) in zip(quiet_parents, parents)], self.color)
+        values = [np.empty(len(moves), dtype=np.float32) for _, moves in parents]
+
+        for p, (_, quiet_moves) in enumerate(quiet_parents): values[p][quiet_moves] = quiet_values[p]
+
+        if noisy:
+            for (p, i), value in zip(noisy, self.model.evaluate_boards(noisy_boards, self.color)): values[p][i] = value
+
+        return values
+
+    @staticmethod
+    def candidate_moves(board):
+        # all moves that can be played on a board
+
+        legal_moves = np.array(tuple(board.legal_moves))
+
+        if legal_moves.size == 0:
+            # if no moves that don't put the king in check are possible,
+            # play one of those (means that the game is over)
+
+            pseudo_legal_moves = board.pseudo_legal_moves
+            legal_moves_uci = {move.uci() for move in legal_moves}
+            pseudo_legal_moves_uci = {move.uci() for move in pseudo_legal_moves}
+            legal_moves = np.array([chess.Move.from_uci(move) for move in legal_moves_uci ^ pseudo_legal_moves_uci])
+
+        return legal_moves
+
+    def search_root(self, board, key, depth, root_moves):
+        # search all root moves (ordered, best first) to depth, returns the best move and its score
+
+        alpha, best_move = -np.inf, root_moves[0]
+        pieces_key = key ^ zobrist.state_key(board)
+
+        for move in root_moves:
+            delta = zobrist.move_key(board, move)
+
+            board.push(move)
+            value = -self.negamax(board, pieces_key ^ delta ^ zobrist.state_key(board), depth, -np.inf, -alpha, 1)
+            board.pop()
+
+            if value > alpha: alpha, best_move = value, move
+
+        self.tt.store(key, depth + 1, TranspositionTable.EXACT, alpha, best_move)
+
+        return best_move, alpha
+
+    @staticmethod
+    def init_worker(model_path, backend, stop):
+        # initialize a pool worker process (see registry.get_pool)
+
+        Searcher.worker_model = Evaluator(registry.get(model_path, backend))
+        Searcher.worker_stop = stop
+
+    @staticmethod
+    def search_move(task):
+        # search the position after a root move in a pool worker process
+        # returns the score of the move (None if the search was aborted), the number of searched nodes,
+        # the best reply (None if unknown), the history scores and killer moves of the worker (only if tables is set)
+        # and the cpu time of the task
+        # (scores <= alpha are only upper bounds)
+
+        # (deadline: wall clock time the search has to be done by, tasks can wait in the queue for a while)
+        # the worker keeps its transposition table, history scores and killer moves for all tasks of the same search,
+        # hint (best reply of the last iteration) and heuristics ((history, killers) of another task) improve the move order
+
+        board, depth, color, alpha, deadline, max_nodes, batch_leaves, quiescence, prefilter, pruning, search_id, hint, heuristics, tables = task
+        start = process_time()
+
+        Searcher.worker_model.prefilter = prefilter
+        searcher = Searcher(Searcher.worker_model, depth, max_nodes=max_nodes, batch_leaves=batch_leaves, quiescence=quiescence, pruning=pruning)
+        searcher.color = color
+        searcher.stop = Searcher.worker_stop
+        searcher.deadline = perf_counter() + (deadline - time()) if deadline is not None else None
+        searcher.search_id = search_id
+        searcher.exact_depth_cutoffs = True # deeper entries of other tasks would make the score depend on the task order
+
+        # (the scores of the tables depend on the perspective and the search features)
+        previous = Searcher.worker_searcher
+        if previous is not None and previous.settings() == searcher.settings(): searcher.reuse_tables(previous, previous.search_id != search_id)
+        Searcher.worker_searcher = searcher
+
+        key = zobrist.board_key(board)
+
+        if hint is not None: searcher.tt.store_move(key, hint)
+        if heuristics is not None: searcher.merge_heuristics(*heuristics)
+
+        try:
+            value = -searcher.negamax(board, key, depth, -np.inf, -alpha, 1)
+        except SearchAborted:
+            value = None
+
+        entry = searcher.tt.probe(key)
+
+        return value, searcher.nodes, entry[3] if entry else None, (searcher.history, searcher.killers) if tables else None, process_time() - start
+
+    def run_tasks(self, board, depth, moves, alpha, heuristics=None, tables=False):
+        # search the positions after moves in the pool workers (alpha: score the moves have to beat,
+        # heuristics: (history, killers) passed to the tasks, tables: return the ones of the tasks)
+        # returns the scores of the moves and the (history, killers) of the tasks
+        # (the best replies are stored in the transposition table, like a serial search does, see Game.expected_reply)
+
+        pool, pool_stop = self.pool
+        deadline = time() + (self.deadline - perf_counter()) if self.deadline is not None else None
+        max_nodes = (self.max_nodes - self.nodes) // len(moves) if self.max_nodes is not None else None
+
+        tasks, keys = [], []
+
+        for move in moves:
+            child = board.copy()
+            child.push(move)
+            keys.append(zobrist.board_key(child))
+            tasks.append((child, depth, self.color, alpha, deadline, max_nodes, self.batch_leaves, self.quiescence, self.model.prefilter, self.pruning,
+                          self.search_id, self.task_moves.get(move), heuristics, tables))
+
+        results = pool.map_async(Searcher.search_move, tasks, chunksize=1)
+
+        while not results.ready():
+            results.wait(0.01)
+
+            if self.stop.is_set(): pool_stop.set() # abort() -> stop the workers
+
+        results = results.get()
+        pool_stop.clear()
+
+        self.nodes += sum(nodes for _, nodes, _, _, _ in results)
+        self.task_times.append([task_time for _, _, _, _, task_time in results])
+        values = [value for value, _, _, _, _ in results]
+
+        for move, key, (_, _, reply, _, _) in zip(moves, keys, results):
+            if reply is None: continue
+
+            self.task_moves[move] = reply
+            self.tt.store_move(key, reply)
+
+        if self.stop.is_set() or None in values: raise SearchAborted()
+
+        return values, [task_tables for _, _, _, task_tables, _ in results]
+
+    def search_root_parallel(self, board, depth, root_moves):
+        # search the root moves in parallel: first the principal variation move (full window),
+        # then all other moves at once (1 task per move, with the score of the first move as alpha)
+        # the workers keep their tables for all tasks of the search, the other moves get the history scores
+        # and killer moves of the first one, every task starts with the best reply of its last iteration
+        # (the tables only change the move order: scores > alpha are exact, the others are <= alpha,
+        # so the best move doesn't depend on the number of workers or on the order the tasks are done in)
+        # returns the best move (the first one of equal scores) and its score
+
+        values, tables = self.run_tasks(board, depth, root_moves[:1], -np.inf, tables=True)
+        alpha = values[0]
+
+        if len(root_moves) > 1: values += self.run_tasks(board, depth, root_moves[1:], alpha, tables[0])[0]
+
+        best_i = int(np.argmax(values))
+
+        return root_moves[best_i], values[best_i]
+
+    def predict_best_move(self, board, color, ponder=False):
+        # predict the best move from all possible moves
+        # based on the current board state
+        # using an additional negamax search if depth is bigger 0
+        # (or iterative deepening if there is a time/node budget)
+        # ponder: search on the opponent's time, the time budget only starts with ponder_hit
+        # (the search runs until then or until it's aborted)
+
+        start = self.start = perf_counter()
+        if not ponder: self.deadline = start + self.movetime if self.movetime is not None else None
+        self.nodes = self.completed_depth = 0
+        self.color = color
+        if self.pool: self.search_id, self.task_moves, self.task_times = next(Searcher.search_ids), {}, []
+
+        board = board.copy() # an aborted search leaves moves on the board
+
+        moves = list(board.legal_moves)
+        if not moves: return self.candidate_moves(board)[-1]
+
+        # order the moves by their model outputs (the result of depth 0)
+        scores = self.move_scores(board, moves, self.leaf_values([(board, moves)])[0], 0)
+        root_moves = [moves[i] for i in np.argsort(-scores, kind="stable")]
+        best_move, self.best_value = root_moves[0], float(scores.max())
+
+        if self.movetime is None and self.max_nodes is None:
+            # if user entered depth bigger than 0,
+            # run an additional search of the game tree
+            # for a better move until the max depth is reached
+            depths = (self.depth,) if self.depth > 0 else ()
+        else:
+            depths = range(1, (self.depth or self.max_iterative_depth) + 1)
+
+        key = zobrist.board_key(board)
+
+        for depth in depths:
+            try:
+                if self.pool: best_move, best_value = self.search_root_parallel(board, depth, root_moves)
+                else: best_move, best_value = self.search_root(board, key, depth, root_moves)
+            except SearchAborted:
+                break
+
+            self.completed_depth, self.best_value = depth, best_value
+
+            # principal variation move first in the next iteration
+            root_moves.remove(best_move)
+            root_moves.insert(0, best_move)
+
+        self.elapsed = perf_counter() - start
+
+        return best_move
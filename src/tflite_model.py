@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from threading import Lock
+
+
+class TFLiteModel:
+    # runs a (quantized) tflite model exported by Model.export_quantized on the CPU
+    # (1 interpreter per batch size, the batches are padded to the next power of 2
+    # so the interpreters don't have to be resized for every batch)
+
+    def __init__(self, model_file, threads=None):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter_class = Interpreter
+        self.model_content = open(model_file, "rb").read()
+        self.threads = threads
+        self.interpreters = {} # padded batch size -> (interpreter, input index, output index)
+        self.lock = Lock() # the interpreters aren't thread-safe (the model can be shared by several games)
+
+    def interpreter(self, batch_size):
+        # interpreter with an input of batch_size boards
+
+        if batch_size not in self.interpreters:
+            interpreter = self.interpreter_class(model_content=self.model_content, num_threads=self.threads)
+            input_i, output_i = interpreter.get_input_details()[0]["index"], interpreter.get_output_details()[0]["index"]
+
+            interpreter.resize_tensor_input(input_i, (batch_size, 8, 8, 6))
+            interpreter.allocate_tensors()
+
+            self.interpreters[batch_size] = (interpreter, input_i, output_i)
+
+        return self.interpreters[batch_size]
+
+    def predict(self, X, verbose=0):
+        # calculate the model output for a batch of board tensors (same interface as keras' Model.predict)
+
+        X = np.asarray(X, dtype=np.float32)
+        n = len(X)
+        batch_size = 1 << max(n - 1, 0).bit_length()
+
+        if batch_size != n: X = np.concatenate((X, np.zeros((batch_size - n,) + X.shape[1:], dtype=np.float32)))
+
+        with self.lock:
+            interpreter, input_i, output_i = self.interpreter(batch_size)
+            interpreter.set_tensor(input_i, X)
+            interpreter.invoke()
+
+            return interpreter.get_tensor(output_i)[:n].copy()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import chess
+import chess.polyglot
+import numpy as np
+
+# polyglot zobrist hashing (same keys as chess.polyglot.zobrist_hash),
+# but the keys of child positions are derived from the key of their parent
+RANDOM_ARRAY = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+HASHER = chess.polyglot.ZobristHasher(RANDOM_ARRAY)
+
+
+def board_key(board):
+    # zobrist hash of a board
+
+    return chess.polyglot.zobrist_hash(board)
+
+
+def piece_key(piece_type, color, square):
+    return RANDOM_ARRAY[64 * ((piece_type - 1) * 2 + color) + square]
+
+
+def state_key(board):
+    # part of the zobrist hash that doesn't depend on the pieces (castling rights, en passant square, turn)
+
+    return HASHER.hash_castling(board) ^ HASHER.hash_ep_square(board) ^ HASHER.hash_turn(board)
+
+
+def move_key(board, move):
+    # change of the piece part of the zobrist hash caused by a move
+    # (moved, captured, promoted and castled pieces, see encoder.apply_move)
+
+    from_sq, to_sq = move.from_square, move.to_square
+    piece_type = board.piece_type_at(from_sq)
+    turn = board.turn
+
+    key = piece_key(piece_type, turn, from_sq)
+
+    if piece_type == chess.KING and board.is_castling(move):
+        rank = chess.square_rank(from_sq)
+        kingside = board.is_kingside_castling(move)
+        rook_from = to_sq if board.rooks & board.occupied_co[turn] & chess.BB_SQUARES[to_sq] else chess.square(7 if kingside else 0, rank)
+        to_sq = chess.square(6 if kingside else 2, rank)
+
+        key ^= piece_key(chess.ROOK, turn, rook_from) ^ piece_key(chess.ROOK, turn, chess.square(5 if kingside else 3, rank))
+
+    elif piece_type == chess.PAWN and board.is_en_passant(move):
+        key ^= piece_key(chess.PAWN, not turn, chess.square(chess.square_file(to_sq), chess.square_rank(from_sq)))
+
+    else:
+        captured = board.piece_type_at(to_sq)
+        if captured: key ^= piece_key(captured, not turn, to_sq)
+
+    return key ^ piece_key(move.promotion or piece_type, turn, to_sq)
+
+
+def child_keys(board, moves, key=None):
+    # zobrist hashes of all child positions of a board (one per move)
+    # key: zobrist hash of the board (calculated if not provided)
+
+    if key is None: key = board_key(board)
+
+    pieces_key = key ^ state_key(board)
+    keys = np.empty(len(moves), dtype=np.uint64)
+
+    for i, move in enumerate(moves):
+        delta = move_key(board, move)
+
+        board.push(move)
+        keys[i] = pieces_key ^ delta ^ state_key(board)
+        board.pop()
+
+    return keys